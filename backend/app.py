@@ -1,37 +1,37 @@
-from flask import Flask, render_template, Response, flash, request, redirect, url_for, session, send_from_directory
-from flask_login import LoginManager, UserMixin, login_user, logout_user, current_user, login_required
-from flask_bcrypt import Bcrypt
+from flask import Flask, render_template, Response, flash, request, redirect, url_for, session, jsonify
+from flask_login import LoginManager, login_required
 from flask_migrate import Migrate
-from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import asc
-from werkzeug.utils import secure_filename
 from werkzeug.middleware.dispatcher import DispatcherMiddleware
 from werkzeug.exceptions import NotFound
-from sqlalchemy.exc import SQLAlchemyError
-import cv2
-import pickle
-import numpy as np
-import face_recognition
-import cvzone
-import datetime
-from datetime import time as datetime_time
 import time
-import threading
 import os
-import csv
-import io
-import logging
 import json
-import re
-from utils.helpers import (
-    findEncodings,
-    compare,
-    get_data,
-    mysqlconnect,
-    record_attendance,
-    bcrypt,
-    stop_camera,
+import click
+import functools
+from utils.encoding import build_encodings, DEFAULT_CHUNKSIZE, encode_image_files, load_manifest, \
+    manifest_file_path, record_face_locations
+from utils.preprocess import CHIP_FOLDER, preprocess_upload
+from utils.gallery import (
+    DEFAULT_TOLERANCE,
+    DEFAULT_CACHE_BYTES,
+    gallery_cache,
+    encoding_file_path,
+    save_gallery,
+    convert_pickle_galleries,
 )
+from utils.ann import DEFAULT_NPROBE, load_gallery_with_ann, update_ann_index
+from utils.roster import roster_cache
+from utils.tracking import FaceTracker, DEFAULT_IOU_THRESHOLD, DEFAULT_REVERIFY_FRAMES
+from utils.detection import FaceDetector
+from utils.motion import MotionGate
+from utils.recognition import Recognizer
+from utils.pipeline import DEFAULT_MAX_BACKOFF
+from utils.mjpeg import normalize_quality, normalize_width
+from utils.scheduler import InferenceScheduler, DEFAULT_INFERENCE_WORKERS, DEFAULT_TARGET_FPS
+from utils.camera_broker import CameraBroker, CameraBusyError, DEFAULT_IDLE_TIMEOUT, camera_configs
+from utils.attendance import attendance_recorder, DEFAULT_FLUSH_INTERVAL, DEFAULT_QUEUE_SIZE
+from utils.metrics import registry as metrics_registry
+from utils.rollups import rebuild_rollups
 from models import db, Student_data, Attendance, Users, SessionCode
 
 
@@ -41,7 +41,6 @@ TEMPLATE_DIR = os.path.join(ROOT_DIR, 'frontend', 'templates')
 STATIC_DIR = os.path.join(ROOT_DIR, 'frontend', 'static')
 
 # Load configuration from config.json
-import json
 with open('config.json') as p:
     params = json.load(p)['params']
 
@@ -54,6 +53,13 @@ app.config['SQLALCHEMY_DATABASE_URI'] = params['sql_url']
 db.init_app(app)
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
 app.config['UPLOAD_FOLDER'] = params['upload_folder']
+gallery_cache.set_budget(params.get('gallery_cache_bytes', DEFAULT_CACHE_BYTES))
+# Very large sessions can be matched through an approximate (IVF) index
+ann_params = params.get('ann', {})
+if ann_params.get('enabled'):
+    gallery_cache.loader = lambda path: load_gallery_with_ann(path, ann_params.get('nprobe', DEFAULT_NPROBE))
+attendance_recorder.flush_interval = params.get('attendance_flush_interval', DEFAULT_FLUSH_INTERVAL)
+attendance_recorder.max_queue = params.get('attendance_queue_size', DEFAULT_QUEUE_SIZE)
 hostedapp = Flask(__name__)
 hostedapp.wsgi_app = DispatcherMiddleware(
     NotFound(), {"/Attendance_system": app})
@@ -68,14 +74,12 @@ login_manager.init_app(app)
 from routes.auth_routes import auth_bp
 from routes.general_routes import general_bp
 from routes.admin_routes import admin_bp
+from routes.report_routes import report_bp
 
 app.register_blueprint(auth_bp)
 app.register_blueprint(general_bp)
 app.register_blueprint(admin_bp)
-
-
-# Variables defined
-camera = None  # Global variable to store camera object
+app.register_blueprint(report_bp)
 
 
 @login_manager.user_loader
@@ -83,71 +87,103 @@ def load_user(user_id):
     return db.session.get(Users, int(user_id))
 
 
-# Function to start the camera
-def start_camera():
-    global camera
+# Build the recognizer of a session, or None when it has no encodings yet
+def create_recognizer(session_code_id, camera_config=None):
+    # Get the session gallery, loaded from disk only when it changed
+    gallery = gallery_cache.get(session_code_id)
+    if gallery is None:
+        print(f"Encoding file not found: {encoding_file_path(session_code_id)}")
+        return None
+
+    # Load the session roster once so lookups per face are dictionary hits
+    try:
+        roster = roster_cache.get(session_code_id)
+    except Exception as e:
+        print("Error loading roster:", e)
+        return None
+
+    tracker = FaceTracker(
+        iou_threshold=params.get('track_iou_threshold', DEFAULT_IOU_THRESHOLD),
+        reverify_every=params.get('track_reverify_frames', DEFAULT_REVERIFY_FRAMES),
+    )
+    # Cameras can tune detection scale, regions of interest and motion gating individually
+    camera_config = camera_config or {}
+    detection = camera_config.get('detection', params.get('detection'))
+    motion = camera_config.get('motion', params.get('motion'))
+    return Recognizer(session_code_id, gallery, roster, tracker,
+                      tolerance=params.get('match_tolerance', DEFAULT_TOLERANCE),
+                      detector=FaceDetector.from_config(detection),
+                      motion_gate=MotionGate.from_config(motion),
+                      camera_id=camera_config.get('id'))
+
+
+# One capture and recognition loop per configured camera, shared by all
+# viewers, with recognition for all cameras sharing one worker budget
+inference_scheduler = InferenceScheduler(workers=params.get('inference_workers', DEFAULT_INFERENCE_WORKERS))
+camera_broker = CameraBroker(
+    create_recognizer,
+    camera_configs(params),
+    scheduler=inference_scheduler,
+    idle_timeout=params.get('camera_idle_timeout', DEFAULT_IDLE_TIMEOUT),
+    target_fps=params.get('camera_target_fps', DEFAULT_TARGET_FPS),
+    max_backoff=params.get('camera_reconnect_max_backoff', DEFAULT_MAX_BACKOFF),
+    output_settings=params.get('stream'),
+)
+
+
+# Gauges read from the running components whenever /metrics is scraped
+def scheduling_samples(field):
+    return [((camera_id,), stats[field]) for camera_id, stats in inference_scheduler.stats().items()]
+
+
+metrics_registry.gauge(
+    'face_attendance_camera_up', "1 while the camera delivers frames", ('camera',),
+    lambda: [((camera_id,), int(stats['state'] == 'running')) for camera_id, stats in camera_broker.stats().items()])
+metrics_registry.gauge(
+    'face_attendance_camera_achieved_fps', "Recognition frames per second achieved", ('camera',),
+    lambda: scheduling_samples('achieved_fps'))
+metrics_registry.gauge(
+    'face_attendance_camera_lag_seconds', "How far recognition runs behind its schedule", ('camera',),
+    lambda: scheduling_samples('lag_seconds'))
+metrics_registry.gauge(
+    'face_attendance_attendance_queue_depth', "Sightings waiting to be written",
+    collect=lambda: [((), attendance_recorder.queue_depth)])
+metrics_registry.gauge(
+    'face_attendance_attendance_dropped', "Sightings dropped because the write queue was full",
+    collect=lambda: [((), attendance_recorder.dropped)])
 
-# Function which does the face recognition and displaying the video feed
-def gen_frames(camera, session_code_id, duration=5):
-    from flask import session
-    import os
-    import pickle
 
-    # Step 1: Get session code
+# Function which streams the face recognition video feed of a camera
+def gen_frames(camera_id, session_code_id, duration=5, **settings):
     if not session_code_id:
         print("Session code missing. Cannot load encodings.")
         return  # or yield an error frame
 
-    # Step 2: Construct dynamic encoding path
-    encoding_file_path = f"Resources/EncodeFile_{session_code_id}.p"
-
-    # Step 3: Check if the file exists
-    if not os.path.exists(encoding_file_path):
-        print(f"Encoding file not found: {encoding_file_path}")
+    # Viewers of the same camera share its capture and recognition loop
+    try:
+        feed = camera_broker.subscribe(camera_id, session_code_id)
+    except CameraBusyError as e:
+        print("Error:", e)
+        return
+    if feed is None:
         return  # or yield an error frame
 
-    # Step 4: Load encodings
-    with open(encoding_file_path, 'rb') as file:
-        encodeListKnownWithIds = pickle.load(file)
-    encodeListKnown, studentIds = encodeListKnownWithIds
-
-    start_time = time.time()
-
-    while camera is not None and (time.time() - start_time < duration):
-        success, frame = camera.read()
-        if not success:
-            break
-        imgS = cv2.resize(frame, (0, 0), None, 0.25, 0.25)
-        imgS = cv2.cvtColor(imgS, cv2.COLOR_BGR2RGB)
-        faceCurFrame = face_recognition.face_locations(imgS)
-        encodeCurFrame = face_recognition.face_encodings(imgS, faceCurFrame)
-
-        for encodeFace, faceLoc in zip(encodeCurFrame, faceCurFrame):
-            matches, facedis, matchIndex = compare(encodeListKnown, encodeFace)
-            student_id = get_data(matches, matchIndex, studentIds)
-            data = mysqlconnect(student_id, session_code_id)  # ✅ GOOD
-            name = data[1]
-            roll_no = data[2]
-            div = data[3]
-            branch = data[4]
-            reg_id = student_id
-            print(name)
-            y1, x2, y2, x1 = faceLoc
-            y1, x2, y2, x1 = y1*4, x2*4, y2*4, x1*4
-            bbox = x1, y1, x2 - x1, y2 - y1
-            imgBackground = cvzone.cornerRect(frame, bbox, rt=0)
-            cv2.putText(frame, name, (bbox[0], bbox[1] - 35), cv2.FONT_HERSHEY_SIMPLEX, 0.9,
-                        (255, 255, 0), 3, lineType=cv2.LINE_AA)
-            cv2.putText(imgBackground, reg_id,
-                        (bbox[0], bbox[1] - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 255, 255), 2)
-            current_date = datetime.datetime.now().date()
-            if student_id:
-                t = threading.Thread(target=record_attendance, args=(name, current_date, roll_no, div, branch, reg_id, session_code_id))
-                t.start()
-        ret, buffer = cv2.imencode('.jpg', frame)
-        frame = buffer.tobytes()
-        yield (b'--frame\r\n'
-               b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
+    yield from camera_broker.stream(feed, duration, **settings)
+
+
+# Per-viewer stream settings from the query string, e.g. ?fps=5&quality=60&width=480
+def stream_settings(args):
+    settings = {}
+    fps = args.get('fps', type=float)
+    quality = args.get('quality', type=int)
+    width = args.get('width', type=int)
+    if fps:
+        settings['fps'] = max(fps, 0.1)
+    if quality:
+        settings['quality'] = normalize_quality(quality)
+    if width is not None:
+        settings['width'] = normalize_width(width)
+    return settings
 
 
 @app.route('/enter-session', methods=['GET', 'POST'])
@@ -164,31 +200,42 @@ def enter_session():
 
 
 # Route of video feed to flask webpage on index page
-@app.route('/video1')
-def video1():
+@app.route('/video/<int:camera_id>')
+def video(camera_id):
+    if camera_id not in camera_broker.cameras:
+        return "Invalid camera ID"
     try:
-        camera1 = params['camera_index_1']
-        camera = cv2.VideoCapture(camera1)
         session_code_id = session.get('session_code_id')
 
-        return Response(gen_frames(camera, session_code_id), mimetype='multipart/x-mixed-replace; boundary=frame')
+        return Response(gen_frames(camera_id, session_code_id, **stream_settings(request.args)), mimetype='multipart/x-mixed-replace; boundary=frame')
     except Exception as e:
         print("Error:", e)
         return "Error connecting to the video stream"
 
 
+# Older single-camera routes, kept for existing pages
+@app.route('/video1')
+def video1():
+    return video(1)
+
+
 @app.route('/video2')
 def video2():
-    try:
-        camera2 = params['camera_index_2']
-        camera = cv2.VideoCapture(camera2)
-        session_code_id = session.get('session_code_id')
+    return video(2)
+
+
+# Health, achieved FPS and scheduling lag of every configured camera
+@app.route('/cameras/health')
+@login_required
+def cameras_health():
+    return jsonify(camera_broker.stats())
+
+
+# Prometheus metrics: per-stage timings, face counts, attendance writes, camera health
+@app.route('/metrics')
+def metrics():
+    return Response(metrics_registry.render(), mimetype='text/plain; version=0.0.4')
 
-        return Response(gen_frames(camera, session_code_id), mimetype='multipart/x-mixed-replace; boundary=frame')
-    except Exception as e:
-        print("Error:", e)
-        return "Error connecting to the video stream"
-    
 
 @app.route('/scan/<int:camera_id>')
 def start_scan(camera_id):
@@ -206,23 +253,46 @@ def start_scan(camera_id):
     session_id = session_obj.id  # 👈 This will match your file suffix (e.g. 1 → EncodeFile_1.p)
 
         
-    try:
-        if camera_id == 1:
-            cam_index = params['camera_index_1']
-        elif camera_id == 2:
-            cam_index = params['camera_index_2']
-        else:
-            return "Invalid camera ID"
+    if camera_id not in camera_broker.cameras:
+        return "Invalid camera ID"
 
-        camera = cv2.VideoCapture(cam_index)
-
-        return Response(gen_frames(camera, session_id), mimetype='multipart/x-mixed-replace; boundary=frame')
+    try:
+        return Response(gen_frames(camera_id, session_id, **stream_settings(request.args)), mimetype='multipart/x-mixed-replace; boundary=frame')
 
     except Exception as e:
         print("Error in scan route:", e)
         return "Error starting scan"
 
 
+# Rebuild the gallery of a session from its uploaded images, reusing the
+# manifest for images already encoded, and make the recognizers pick it up.
+# Returns the build_encodings stats.
+def refresh_session_gallery(session_code_id):
+    encoding_path = encoding_file_path(session_code_id)
+    encodeListKnown, studentIds, stats = build_encodings(
+        session_code_id, app.config['UPLOAD_FOLDER'],
+        workers=params.get('encoding_workers') or None,
+        chunksize=params.get('encoding_chunksize', DEFAULT_CHUNKSIZE))
+    save_gallery(encoding_path, encodeListKnown, studentIds)
+    started = time.time()
+    if update_ann_index(encoding_path, ann_params) is not None:
+        print(f"ANN index built in {time.time() - started:.1f}s")
+    gallery_cache.invalidate(session_code_id)
+    refresh_session_feeds(session_code_id)
+    return stats
+
+
+# Make running camera feeds of a session use its current gallery and roster
+def refresh_session_feeds(session_code_id):
+    try:
+        gallery = gallery_cache.get(session_code_id)
+        roster = roster_cache.get(session_code_id)
+    except Exception as e:
+        print("Error:", e)
+        return
+    camera_broker.refresh(session_code_id, gallery, roster)
+
+
 # Route to trigger encoding manually
 @app.route('/generate_encodings', methods=['GET', 'POST'])
 def generate_encodings():
@@ -231,34 +301,25 @@ def generate_encodings():
         return redirect(url_for('auth_bp.login'))
 
     if request.method == 'POST':
-        # Delete existing encoding file if it exists
-        encoding_file_path = f"Resources/EncodeFile_{session['session_code_id']}.p"
-        if os.path.exists(encoding_file_path):
-            os.remove(encoding_file_path)
-            print("File removed")
-            flash("File Removed")
-
-        # Importing the student images
-        folderPath = os.path.join('uploads', str(session['session_code_id']))
-        pathList = os.listdir(folderPath)
-        imgList = []
-        studentIds = []
-        for path in pathList:
-            imgList.append(cv2.imread(os.path.join(folderPath, path)))
-            studentIds.append(os.path.splitext(path)[0])
-            print(os.path.splitext(path)[0])
-        # Generate encodings
+        session_code_id = session['session_code_id']
+
+        # Generate encodings, reusing the manifest for images that did not change
         try:
             print("Encoding started...")
             error_message = 'Encoding started...'
             flash("Encoding started...", "success")
-            encodeListKnown = findEncodings(imgList)
-            encodeListKnownWithIds = [encodeListKnown, studentIds]
-            print("Encoding complete")
+            started = time.time()
+            stats = refresh_session_gallery(session_code_id)
+            elapsed = time.time() - started
+            print(f"Encoding complete in {elapsed:.1f}s: {stats['reused']} reused, "
+                  f"{stats['computed']} recomputed ({stats['known_location']} without detection), "
+                  f"{stats['removed']} removed")
             error_message = 'Encoding complete'
-            flash("Encoding complete", "success")
-            with open(encoding_file_path, 'wb') as file:
-                pickle.dump(encodeListKnownWithIds, file)
+            flash(f"Encoding complete in {elapsed:.1f}s: {stats['reused']} images reused, "
+                  f"{stats['computed']} recomputed, {stats['removed']} removed", "success")
+            for filename, reason in stats['failed']:
+                print(f"Skipped {filename}: {reason}")
+                flash(f"Skipped {filename}: {reason}", "error")
             print("File Saved")
             error_message = 'Encodings generated successfully!'
             flash('Encodings generated successfully!', 'success')
@@ -272,10 +333,67 @@ def generate_encodings():
     return render_template('data.html', error=error_message)
 
 
+# One-time conversion of pickled galleries: `flask --app app convert-galleries`
+@app.cli.command('convert-galleries')
+def convert_galleries():
+    converted = convert_pickle_galleries()
+    for path in converted:
+        print(f"Converted {path}")
+    print(f"{len(converted)} galleries converted")
+
+
+# Fill or repair the reporting rollups from the attendance table:
+# `flask --app app rollup-backfill [--session ID] [--start YYYY-MM-DD] [--end YYYY-MM-DD]`
+@app.cli.command('rollup-backfill')
+@click.option('--session', 'session_code_id', type=int, default=None, help='Only this session id.')
+@click.option('--start', type=click.DateTime(formats=['%Y-%m-%d']), default=None, help='First day (whole month).')
+@click.option('--end', type=click.DateTime(formats=['%Y-%m-%d']), default=None, help='Last day (whole month).')
+def rollup_backfill(session_code_id, start, end):
+    counted = rebuild_rollups(db, session_code_id,
+                              start.date() if start else None, end.date() if end else None)
+    for session_id, rows in counted.items():
+        print(f"Session {session_id}: {rows} attendance rows rolled up")
+    print(f"{len(counted)} sessions rebuilt")
+
+
+# Preprocess photos uploaded before upload-time preprocessing existed:
+# downsize them, record their face location and cut their chips, so the next
+# encoding run skips detection. `flask --app app preprocess-uploads [--session ID]`
+@app.cli.command('preprocess-uploads')
+@click.option('--session', 'session_code_id', type=int, default=None, help='Only this session id.')
+def preprocess_uploads(session_code_id):
+    upload_folder = app.config['UPLOAD_FOLDER']
+    if session_code_id is None:
+        sessions = sorted(name for name in os.listdir(upload_folder)
+                          if name.isdigit() and os.path.isdir(os.path.join(upload_folder, name)))
+    else:
+        sessions = [str(session_code_id)]
+
+    for session_id in sessions:
+        folder = os.path.join(upload_folder, session_id)
+        manifest = load_manifest(manifest_file_path(session_id))
+        # Photos with a recorded location were preprocessed already
+        pending = sorted(name for name in os.listdir(folder)
+                         if not name.startswith('.') and os.path.isfile(os.path.join(folder, name))
+                         and 'location' not in manifest.get(name, {}))
+        worker = functools.partial(preprocess_upload, chip_folder=os.path.join(upload_folder, CHIP_FOLDER, session_id),
+                                   **params.get('enrollment', {}))
+        locations = {}
+        for path, location, error in encode_image_files(
+                [os.path.join(folder, name) for name in pending],
+                workers=params.get('encoding_workers') or None,
+                chunksize=params.get('encoding_chunksize', DEFAULT_CHUNKSIZE), encode=worker):
+            if error is None:
+                locations[os.path.basename(path)] = location
+            else:
+                print(f"Skipped {path}: {error}")
+        record_face_locations(session_id, upload_folder, locations)
+        print(f"Session {session_id}: {len(locations)} of {len(pending)} photos preprocessed")
+
+
 # Route to the index page where the camera feed is displayed
 @app.route('/')
 def index():
-    start_camera()
     return render_template('index.html')
 
 
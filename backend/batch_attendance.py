@@ -0,0 +1,221 @@
+# Rebuild attendance offline from recorded lecture videos or image folders.
+#
+# Runs headless (no Flask server) from the backend directory, e.g.
+#   python batch_attendance.py --session 1 --stride 5 recordings/lecture1.mp4 photos/
+#
+# Every `stride`-th frame is matched against the session gallery exactly like
+# the live stream does. Videos are split into frame ranges so all cores are
+# busy even with a single long file. A student's start and end time on each
+# day are their first and last sighting that day, as record_attendance()
+# would have written them, and all rows are written in one bulk upsert at the
+# end.
+import argparse
+import datetime
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import cv2
+import face_recognition
+
+from utils.detection import FaceDetector, DEFAULT_DETECTION_SCALE
+from utils.gallery import DEFAULT_TOLERANCE, encoding_file_path, load_gallery
+from utils.roster import EMPTY_ROSTER_ENTRY
+
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg'}
+DEFAULT_STRIDE = 5
+DEFAULT_CHUNK_FRAMES = 1500
+
+# Per worker process state, set up once by _init_worker
+_gallery = None
+_detector = None
+_tolerance = DEFAULT_TOLERANCE
+
+
+def _init_worker(session_code_id, tolerance, scale):
+    global _gallery, _detector, _tolerance
+    _gallery = load_gallery(encoding_file_path(session_code_id))
+    _detector = FaceDetector(scale=scale)
+    _tolerance = tolerance
+
+
+# Student ids recognized in one BGR frame
+def _match_frame(frame):
+    boxes = _detector.detect(frame)
+    if not boxes:
+        return []
+    img = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    encodings = face_recognition.face_encodings(img, boxes)
+    return [student_id for student_id in _gallery.best_matches(encodings, _tolerance) if student_id]
+
+
+def _see(sightings, student_id, seen_at):
+    key = (student_id, seen_at.date())
+    first, last = sightings.get(key, (seen_at, seen_at))
+    sightings[key] = (min(first, seen_at), max(last, seen_at))
+
+
+# Process one unit of work; returns (path, frames processed, sightings) where
+# sightings maps (student id, date) -> (first seen, last seen) that day
+def process_unit(unit):
+    sightings = {}
+    processed = 0
+    if unit['kind'] == 'images':
+        for image_path in unit['images']:
+            frame = cv2.imread(image_path)
+            if frame is None:
+                continue
+            seen_at = datetime.datetime.fromtimestamp(os.path.getmtime(image_path))
+            for student_id in _match_frame(frame):
+                _see(sightings, student_id, seen_at)
+            processed += 1
+        return unit['path'], processed, sightings
+
+    capture = cv2.VideoCapture(unit['path'])
+    try:
+        capture.set(cv2.CAP_PROP_POS_FRAMES, unit['start'])
+        frame_no = unit['start']
+        while unit['stop'] is None or frame_no < unit['stop']:
+            # Skipped frames are only grabbed, not decoded into images
+            if (frame_no - unit['start']) % unit['stride']:
+                if not capture.grab():
+                    break
+                frame_no += 1
+                continue
+            success, frame = capture.read()
+            if not success:
+                break
+            seen_at = unit['started_at'] + datetime.timedelta(seconds=frame_no / unit['fps'])
+            for student_id in _match_frame(frame):
+                _see(sightings, student_id, seen_at)
+            processed += 1
+            frame_no += 1
+    finally:
+        capture.release()
+    return unit['path'], processed, sightings
+
+
+# Split the inputs into units of at most chunk_frames frames each. Returns
+# (units, frames to process per path).
+def plan_work(paths, stride, chunk_frames, started_at=None):
+    units = []
+    totals = {}
+    for path in paths:
+        if os.path.isdir(path):
+            images = sorted(
+                os.path.join(path, f) for f in os.listdir(path)
+                if os.path.splitext(f)[1].lower() in IMAGE_EXTENSIONS
+            )[::stride]
+            totals[path] = len(images)
+            per_unit = max(chunk_frames // stride, 1)
+            for i in range(0, len(images), per_unit):
+                units.append({'kind': 'images', 'path': path, 'images': images[i:i + per_unit]})
+            continue
+
+        capture = cv2.VideoCapture(path)
+        if not capture.isOpened():
+            print(f"Skipping {path}: cannot open video")
+            continue
+        frame_count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT)) or 0
+        fps = capture.get(cv2.CAP_PROP_FPS) or 25.0
+        capture.release()
+
+        # Without an explicit start, the recording is assumed to end at the file's mtime
+        video_start = started_at or (
+            datetime.datetime.fromtimestamp(os.path.getmtime(path)) -
+            datetime.timedelta(seconds=frame_count / fps))
+        totals[path] = (frame_count + stride - 1) // stride if frame_count else None
+
+        base = {'kind': 'video', 'path': path, 'stride': stride, 'fps': fps, 'started_at': video_start}
+        if not frame_count:
+            units.append(dict(base, start=0, stop=None))
+            continue
+        chunk = max(chunk_frames // stride, 1) * stride
+        for start in range(0, frame_count, chunk):
+            units.append(dict(base, start=start, stop=min(start + chunk, frame_count)))
+    return units, totals
+
+
+# Attendance rows for the recorder, one per student and day
+def attendance_rows(sightings, roster, session_code_id):
+    rows = {}
+    skipped = set()
+    for (student_id, day), (first, last) in sorted(sightings.items()):
+        _, name, roll_no, div, branch = roster.get(student_id, EMPTY_ROSTER_ENTRY)
+        if name is None:
+            if student_id not in skipped:
+                print(f"Skipping {student_id}: not enrolled in session {session_code_id}")
+                skipped.add(student_id)
+            continue
+        rows[(student_id, day, session_code_id)] = {
+            'name': name, 'roll_no': roll_no, 'division': div, 'branch': branch,
+            'reg_id': student_id, 'date': day, 'session_code_id': session_code_id,
+            'start_time': first.strftime("%H:%M:%S"), 'end_time': last.strftime("%H:%M:%S"),
+        }
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rebuild attendance from recorded videos or image folders.")
+    parser.add_argument('paths', nargs='+', help="video files and/or directories of images")
+    parser.add_argument('--session', required=True, type=int, help="numeric session code id")
+    parser.add_argument('--stride', type=int, default=DEFAULT_STRIDE, help="process every Nth frame")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument('--chunk-frames', type=int, default=DEFAULT_CHUNK_FRAMES,
+                        help="video frames per unit of work")
+    parser.add_argument('--scale', type=float, default=DEFAULT_DETECTION_SCALE, help="detection downscale")
+    parser.add_argument('--start', type=datetime.datetime.fromisoformat, default=None,
+                        help="recording start, e.g. 2024-04-02T10:00:00 (default: from file mtime)")
+    parser.add_argument('--dry-run', action='store_true', help="recognize but do not write attendance")
+    args = parser.parse_args(argv)
+
+    # Configuration and database come from the app, but the server is not started
+    from app import params
+    from utils.attendance import attendance_recorder
+    from utils.roster import roster_cache
+
+    if not os.path.exists(encoding_file_path(args.session)):
+        parser.error(f"Encoding file not found: {encoding_file_path(args.session)}")
+
+    units, totals = plan_work(args.paths, max(args.stride, 1), args.chunk_frames, args.start)
+    if not units:
+        parser.error("Nothing to process")
+    workers = args.workers or os.cpu_count() or 1
+    tolerance = params.get('match_tolerance', DEFAULT_TOLERANCE)
+    print(f"Processing {len(units)} units from {len(totals)} inputs on {workers} workers")
+
+    sightings = {}
+    done = dict.fromkeys(totals, 0)
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(args.session, tolerance, args.scale)) as executor:
+        futures = [executor.submit(process_unit, unit) for unit in units]
+        for future in as_completed(futures):
+            path, processed, unit_sightings = future.result()
+            for (student_id, _), (first, last) in unit_sightings.items():
+                _see(sightings, student_id, first)
+                _see(sightings, student_id, last)
+            done[path] += processed
+            elapsed = time.perf_counter() - started
+            total = totals[path]
+            progress = f"{done[path]}/{total}" if total else f"{done[path]}"
+            print(f"{path}: {progress} frames, {sum(done.values()) / elapsed:.1f} frames/s overall")
+
+    elapsed = time.perf_counter() - started
+    frames = sum(done.values())
+    print(f"Processed {frames} frames in {elapsed:.1f}s ({frames / elapsed:.1f} frames/s), "
+          f"{len({student_id for student_id, _ in sightings})} students recognized")
+
+    rows = attendance_rows(sightings, roster_cache.load(args.session), args.session)
+    if args.dry_run:
+        for row in rows.values():
+            print(f"{row['date']} {row['reg_id']} {row['name']} {row['start_time']}-{row['end_time']}")
+        return
+    if rows:
+        attendance_recorder.flush(rows)
+    print(f"Wrote {len(rows)} attendance rows in {attendance_recorder.last_flush_seconds:.2f}s "
+          f"({attendance_recorder.errors} errors)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,287 @@
+# Micro-benchmarks for the recognition hot path.
+#
+# Run from the backend directory, offline (SQLite in memory, no MySQL, no camera):
+#   python -m benchmarks.recognition --output bench.json
+#
+# Galleries of random normalized 128-d encodings are generated at each size and
+# the results written as JSON, so runs on different commits can be compared.
+# Galleries of at least --ann-min identities also get an IVF index, reported
+# with its recall against exact search for each probe count.
+import argparse
+import json
+import os
+import pickle
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import cv2
+import face_recognition
+import numpy as np
+from flask import Flask
+
+from models import db, SessionCode, Student_data
+from utils.ann import build_ivf
+from utils.gallery import ENCODING_DIM, GalleryIndex, load_gallery, load_pickle_gallery, save_gallery
+from utils.helpers import compare, findEncodings, get_data
+from utils.roster import load_roster
+
+DEFAULT_SIZES = (100, 1000, 10000, 100000)
+DEFAULT_FACES = 5
+DEFAULT_REPEAT = 5
+DEFAULT_LOOKUPS = 1000
+DEFAULT_NPROBES = (1, 4, 8, 16, 32)
+DEFAULT_ANN_MIN = 10000
+DEFAULT_RECALL_QUERIES = 200
+FRAME_SIZE = (1280, 720)
+
+
+# Run fn `repeat` times and summarize the wall-clock seconds per run
+def measure(fn, repeat, ops=1):
+    fn()  # warm up caches and lazy imports
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - started)
+    median = statistics.median(times)
+    return {
+        'repeat': repeat,
+        'min_seconds': min(times),
+        'median_seconds': median,
+        'mean_seconds': statistics.fmean(times),
+        'ops_per_second': ops / median if median else None,
+    }
+
+
+def random_gallery(rng, size):
+    encodings = rng.standard_normal((size, ENCODING_DIM)).astype(np.float32)
+    encodings /= np.linalg.norm(encodings, axis=1, keepdims=True)
+    return encodings, [f"S{i:06d}" for i in range(size)]
+
+
+# Faces close to known students, as a camera frame would produce
+def random_faces(rng, encodings, count):
+    picks = rng.integers(0, len(encodings), count)
+    return encodings[picks] + rng.normal(0, 0.02, (count, ENCODING_DIM)).astype(np.float32)
+
+
+# Smooth synthetic camera frame; noise-only images compress unrealistically badly
+def synthetic_frame(rng, width, height):
+    small = rng.integers(0, 256, (height // 16, width // 16, 3), dtype=np.uint8)
+    frame = cv2.resize(small, (width, height), interpolation=cv2.INTER_CUBIC)
+    noise = rng.integers(0, 8, frame.shape, dtype=np.uint8)
+    return cv2.add(frame, noise)
+
+
+def bench_gallery_load(folder, size, encodings, student_ids, repeat):
+    pickle_path = os.path.join(folder, f"EncodeFile_{size}.p")
+    gallery_path = os.path.join(folder, f"EncodeFile_{size}.gal")
+    with open(pickle_path, 'wb') as file:
+        pickle.dump([list(encodings.astype(np.float64)), student_ids], file)
+    save_gallery(gallery_path, encodings, student_ids)
+    return {
+        'gallery_load_pickle': measure(lambda: load_pickle_gallery(pickle_path), repeat),
+        'gallery_load_binary': measure(lambda: load_gallery(gallery_path), repeat),
+    }
+
+
+def bench_matching(encodings, student_ids, faces, repeat):
+    # The legacy path: list of float64 arrays, one compare() + get_data() per face
+    known = list(encodings.astype(np.float64))
+
+    def legacy():
+        for face in faces:
+            matches, faceDis, matchIndex = compare(known, face)
+            get_data(matches, matchIndex, student_ids)
+
+    gallery = GalleryIndex(encodings, student_ids)
+    return {
+        'match_compare': measure(legacy, repeat, ops=len(faces)),
+        'match_gallery_index': measure(lambda: gallery.best_matches(faces), repeat, ops=len(faces)),
+    }
+
+
+# IVF build time, lookup time and recall@1 against exact search per probe count
+def bench_ann(encodings, student_ids, faces, rng, repeat, nprobes, queries=DEFAULT_RECALL_QUERIES):
+    gallery = GalleryIndex(encodings, student_ids)
+    started = time.perf_counter()
+    index = build_ivf(gallery)
+    results = {'ann_build': {'seconds': time.perf_counter() - started, 'nlist': index.nlist}}
+
+    probe_faces = random_faces(rng, encodings, queries)
+    exact = gallery.best_matches(probe_faces)
+    found = sum(1 for student_id in exact if student_id)
+    for nprobe in nprobes:
+        index.nprobe = nprobe
+        approximate = index.best_matches(probe_faces)
+        hits = sum(1 for a, e in zip(approximate, exact) if e and a == e)
+        result = measure(lambda: index.best_matches(faces), repeat, ops=len(faces))
+        result['recall_at_1'] = hits / found if found else None
+        result['candidates_per_face'] = float(np.mean([len(c) for c in index.candidates(probe_faces)]))
+        results[f"match_ivf_nprobe{nprobe}"] = result
+    return results
+
+
+def bench_roster(app, size, student_ids, rng, repeat, lookups=DEFAULT_LOOKUPS):
+    with app.app_context():
+        session_code = SessionCode(code=f"bench-{size}", business_name="Benchmark")
+        db.session.add(session_code)
+        db.session.flush()
+        db.session.execute(db.insert(Student_data), [
+            {'name': f"Student {regid}", 'rollno': regid, 'division': 'A', 'branch': 'CS',
+             'regid': regid, 'session_code_id': session_code.id}
+            for regid in (f"{size}-{student_id}" for student_id in student_ids)
+        ])
+        db.session.commit()
+        session_code_id = session_code.id
+
+        roster = load_roster(db, Student_data, session_code_id)
+        wanted = [f"{size}-{student_ids[i]}" for i in rng.integers(0, size, lookups)]
+        return {
+            'roster_load': measure(lambda: load_roster(db, Student_data, session_code_id), repeat),
+            'roster_lookup': measure(lambda: [roster.get(regid) for regid in wanted], repeat, ops=lookups),
+        }
+
+
+def bench_jpeg(rng, repeat):
+    frame = synthetic_frame(rng, *FRAME_SIZE)
+    results = {}
+    for quality in (75, 95):
+        results[f"jpeg_encode_q{quality}"] = measure(
+            lambda: cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality]), repeat)
+
+    def resized():
+        image = cv2.resize(frame, (640, 360), interpolation=cv2.INTER_AREA)
+        cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 75])
+
+    results['jpeg_encode_q75_640w'] = measure(resized, repeat)
+    return results
+
+
+# Enrollment photos of an upload folder: the files of its numeric session
+# folders, or of the folder itself when it has none. Dotfiles and dot folders
+# (thumbnails, face chips, staged uploads) are not enrollment photos.
+def enrollment_photos(folder):
+    sessions = sorted(entry.path for entry in os.scandir(folder) if entry.is_dir() and entry.name.isdigit())
+    paths = []
+    for session_folder in sessions or [folder]:
+        paths.extend(os.path.join(session_folder, f) for f in sorted(os.listdir(session_folder))
+                     if not f.startswith('.') and os.path.isfile(os.path.join(session_folder, f))
+                     and f.rsplit('.', 1)[-1].lower() in ('png', 'jpg', 'jpeg'))
+    return paths
+
+
+def bench_find_encodings(folder, repeat):
+    if not os.path.isdir(folder):
+        return {'find_encodings': {'skipped': f"{folder} is not a folder"}}
+    images, without_face = [], 0
+    for img in (cv2.imread(path) for path in enrollment_photos(folder)):
+        if img is None:
+            continue
+        # findEncodings expects a face in every image, so photos without one
+        # are counted rather than benchmarked
+        if face_recognition.face_locations(cv2.cvtColor(img, cv2.COLOR_BGR2RGB)):
+            images.append(img)
+        else:
+            without_face += 1
+    if not images:
+        return {'find_encodings': {'skipped': f"no face images in {folder}", 'without_face': without_face}}
+    result = measure(lambda: findEncodings(images), repeat, ops=len(images))
+    result.update(images=len(images), without_face=without_face)
+    return {'find_encodings': result}
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes, faces, repeat, images, seed, nprobes=DEFAULT_NPROBES, ann_min=DEFAULT_ANN_MIN):
+    rng = np.random.default_rng(seed)
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as folder:
+        for size in sizes:
+            print(f"Benchmarking gallery of {size} identities", file=sys.stderr)
+            encodings, student_ids = random_gallery(rng, size)
+            frame_faces = random_faces(rng, encodings, faces)
+            sized = {}
+            sized.update(bench_gallery_load(folder, size, encodings, student_ids, repeat))
+            sized.update(bench_matching(encodings, student_ids, frame_faces, repeat))
+            if size >= ann_min:
+                sized.update(bench_ann(encodings, student_ids, frame_faces, rng, repeat, nprobes))
+            sized.update(bench_roster(app, size, student_ids, rng, repeat))
+            results[str(size)] = sized
+
+    results['frame'] = bench_jpeg(rng, repeat)
+    if images:
+        results['frame'].update(bench_find_encodings(images, repeat))
+
+    return {
+        'commit': git_commit(),
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+        'cpu_count': os.cpu_count(),
+        'seed': seed,
+        'faces_per_frame': faces,
+        'results': results,
+    }
+
+
+def print_summary(report):
+    for group, benchmarks in report['results'].items():
+        for name, result in benchmarks.items():
+            if 'skipped' in result:
+                print(f"{group:>8} {name:<24} skipped: {result['skipped']}", file=sys.stderr)
+            elif 'median_seconds' not in result:
+                print(f"{group:>8} {name:<24} {result['seconds'] * 1000:10.3f} ms", file=sys.stderr)
+            else:
+                recall = f" recall@1 {result['recall_at_1']:.3f}" if result.get('recall_at_1') is not None else ''
+                print(f"{group:>8} {name:<24} {result['median_seconds'] * 1000:10.3f} ms "
+                      f"{result['ops_per_second']:12.1f} ops/s{recall}", file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the recognition hot path.")
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                        help="comma separated gallery sizes")
+    parser.add_argument('--faces', type=int, default=DEFAULT_FACES, help="faces per frame to match")
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help="timed runs per benchmark")
+    parser.add_argument('--images', default='uploads',
+                        help="folder of face photos for findEncodings ('' to skip)")
+    parser.add_argument('--nprobe', default=','.join(map(str, DEFAULT_NPROBES)),
+                        help="comma separated IVF probe counts to compare")
+    parser.add_argument('--ann-min', type=int, default=DEFAULT_ANN_MIN,
+                        help="smallest gallery to benchmark the IVF index on")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help="write JSON here instead of stdout")
+    args = parser.parse_args(argv)
+
+    sizes = [int(size) for size in args.sizes.split(',') if size]
+    nprobes = [int(nprobe) for nprobe in args.nprobe.split(',') if nprobe]
+    report = run(sizes, args.faces, args.repeat, args.images, args.seed, nprobes, args.ann_min)
+    print_summary(report)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
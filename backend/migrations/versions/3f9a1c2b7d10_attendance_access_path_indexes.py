@@ -0,0 +1,108 @@
+"""Index the attendance, roster and login access paths
+
+Adds a unique key on attendance (session_code_id, reg_id, date) so a sighting
+is a single INSERT ... ON DUPLICATE KEY UPDATE, and composite indexes for the
+per-session listings, roster loads and logins. The old unique key on
+(name, date) is dropped: it rejected the same student in two sessions on one
+day and does not match any query.
+
+Duplicate attendance rows left by the old check-then-insert race are merged
+(earliest start, latest end) before the unique key is created.
+
+Databases created from scratch with db.create_all() already have these keys;
+mark them as migrated with `flask db stamp head`.
+
+Revision ID: 3f9a1c2b7d10
+Revises:
+Create Date: 2026-10-17 04:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f9a1c2b7d10'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def _names(table, kind):
+    inspector = sa.inspect(op.get_bind())
+    if kind == 'unique':
+        found = inspector.get_unique_constraints(table)
+    else:
+        found = inspector.get_indexes(table)
+    return {item['name'] for item in found}
+
+
+def _merge_duplicate_attendance():
+    bind = op.get_bind()
+    if bind.dialect.name in ('mysql', 'mariadb'):
+        bind.execute(sa.text("""
+            UPDATE attendance a
+            JOIN (
+                SELECT MIN(id) AS id, MIN(start_time) AS start_time, MAX(end_time) AS end_time
+                FROM attendance
+                GROUP BY session_code_id, reg_id, date
+                HAVING COUNT(*) > 1
+            ) d ON a.id = d.id
+            SET a.start_time = d.start_time, a.end_time = d.end_time
+        """))
+        bind.execute(sa.text("""
+            DELETE a FROM attendance a
+            JOIN attendance b
+              ON a.session_code_id = b.session_code_id AND a.reg_id = b.reg_id
+             AND a.date = b.date AND a.id > b.id
+        """))
+    else:
+        bind.execute(sa.text("""
+            UPDATE attendance SET
+                start_time = (SELECT MIN(b.start_time) FROM attendance b
+                              WHERE b.session_code_id = attendance.session_code_id
+                                AND b.reg_id = attendance.reg_id AND b.date = attendance.date),
+                end_time = (SELECT MAX(b.end_time) FROM attendance b
+                            WHERE b.session_code_id = attendance.session_code_id
+                              AND b.reg_id = attendance.reg_id AND b.date = attendance.date)
+        """))
+        bind.execute(sa.text("""
+            DELETE FROM attendance WHERE id NOT IN (
+                SELECT id FROM (
+                    SELECT MIN(id) AS id FROM attendance GROUP BY session_code_id, reg_id, date
+                ) AS keep
+            )
+        """))
+
+
+def upgrade():
+    _merge_duplicate_attendance()
+
+    unique = _names('attendance', 'unique')
+    indexes = _names('attendance', 'index')
+    with op.batch_alter_table('attendance', schema=None) as batch_op:
+        if 'uix_name_date' in unique or 'uix_name_date' in indexes:
+            batch_op.drop_constraint('uix_name_date', type_='unique')
+        batch_op.create_unique_constraint('uix_session_reg_date', ['session_code_id', 'reg_id', 'date'])
+        batch_op.create_index('ix_attendance_session_date_reg', ['session_code_id', 'date', 'reg_id'])
+
+    with op.batch_alter_table('student_data', schema=None) as batch_op:
+        batch_op.create_index('ix_student_data_session_regid', ['session_code_id', 'regid'])
+
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.create_index('ix_users_username_session', ['username', 'session_code_id'])
+        batch_op.create_index('ix_users_reg_id', ['reg_id'])
+
+
+def downgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_index('ix_users_reg_id')
+        batch_op.drop_index('ix_users_username_session')
+
+    with op.batch_alter_table('student_data', schema=None) as batch_op:
+        batch_op.drop_index('ix_student_data_session_regid')
+
+    with op.batch_alter_table('attendance', schema=None) as batch_op:
+        batch_op.drop_index('ix_attendance_session_date_reg')
+        batch_op.drop_constraint('uix_session_reg_date', type_='unique')
+        batch_op.create_unique_constraint('uix_name_date', ['name', 'date'])
@@ -0,0 +1,30 @@
+"""Index the attendance listing order
+
+The attendance pages are keyset paginated on (date, id) within a session;
+this index returns them in that order, so a page reads only its own rows
+instead of sorting the whole session.
+
+Revision ID: 5d7b3e9a2c41
+Revises: 8c4e2a6f1b93
+Create Date: 2026-10-17 15:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d7b3e9a2c41'
+down_revision = '8c4e2a6f1b93'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('attendance', schema=None) as batch_op:
+        batch_op.create_index('ix_attendance_session_date_id', ['session_code_id', 'date', 'id'])
+
+
+def downgrade():
+    with op.batch_alter_table('attendance', schema=None) as batch_op:
+        batch_op.drop_index('ix_attendance_session_date_id')
@@ -0,0 +1,60 @@
+"""Add the attendance rollup tables used by the reports
+
+attendance_daily_summary counts students present per session, day, branch
+and division; attendance_monthly_student counts the days each student was
+present per month. Both are maintained by the attendance writer. Fill them
+for existing history with `flask --app app rollup-backfill`.
+
+Revision ID: 8c4e2a6f1b93
+Revises: 3f9a1c2b7d10
+Create Date: 2026-10-17 09:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c4e2a6f1b93'
+down_revision = '3f9a1c2b7d10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'attendance_daily_summary',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('session_code_id', sa.Integer(), nullable=False),
+        sa.Column('date', sa.Date(), nullable=False),
+        sa.Column('branch', sa.String(length=100), nullable=False),
+        sa.Column('division', sa.String(length=10), nullable=False),
+        sa.Column('present', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['session_code_id'], ['session_code.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('session_code_id', 'date', 'branch', 'division', name='uix_daily_summary_key')
+    )
+    op.create_table(
+        'attendance_monthly_student',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('session_code_id', sa.Integer(), nullable=False),
+        sa.Column('reg_id', sa.String(length=100), nullable=False),
+        sa.Column('month', sa.Date(), nullable=False),
+        sa.Column('name', sa.String(length=100), nullable=True),
+        sa.Column('branch', sa.String(length=100), nullable=False),
+        sa.Column('division', sa.String(length=10), nullable=False),
+        sa.Column('days_present', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['session_code_id'], ['session_code.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('session_code_id', 'reg_id', 'month', name='uix_monthly_student_key')
+    )
+    with op.batch_alter_table('attendance_monthly_student', schema=None) as batch_op:
+        batch_op.create_index('ix_monthly_student_session_month', ['session_code_id', 'month'])
+
+
+def downgrade():
+    with op.batch_alter_table('attendance_monthly_student', schema=None) as batch_op:
+        batch_op.drop_index('ix_monthly_student_session_month')
+
+    op.drop_table('attendance_monthly_student')
+    op.drop_table('attendance_daily_summary')
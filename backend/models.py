@@ -18,6 +18,11 @@ class Student_data(db.Model):
     # Foreign key to link to session codes
     session_code_id = db.Column(db.Integer, db.ForeignKey('session_code.id'), nullable=False)
 
+    # Rosters are loaded and looked up per session
+    __table_args__ = (
+        db.Index('ix_student_data_session_regid', 'session_code_id', 'regid'),
+    )
+
     
 
 
@@ -37,8 +42,47 @@ class Attendance(db.Model):
     # Foreign key to link to session codes
     session_code_id = db.Column(db.Integer, db.ForeignKey('session_code.id'), nullable=False)
 
+    # One row per student, day and session; lets attendance be written with a
+    # single upsert. The second index serves the per-day listings and exports,
+    # the third the keyset pages ordered by (date, id).
+    __table_args__ = (
+        db.UniqueConstraint('session_code_id', 'reg_id', 'date', name='uix_session_reg_date'),
+        db.Index('ix_attendance_session_date_reg', 'session_code_id', 'date', 'reg_id'),
+        db.Index('ix_attendance_session_date_id', 'session_code_id', 'date', 'id'),
+    )
+
+
+# Rollup of students present per day, session, branch and division.
+# Kept up to date by the attendance writer; branch/division are '' when unknown.
+class AttendanceDailySummary(db.Model):
+    __tablename__ = 'attendance_daily_summary'
+    id = db.Column(db.Integer, primary_key=True)
+    session_code_id = db.Column(db.Integer, db.ForeignKey('session_code.id'), nullable=False)
+    date = db.Column(db.Date, nullable=False)
+    branch = db.Column(db.String(100), nullable=False, default='')
+    division = db.Column(db.String(10), nullable=False, default='')
+    present = db.Column(db.Integer, nullable=False, default=0)
+
     __table_args__ = (
-    db.UniqueConstraint('name', 'date', name='uix_name_date'),
+        db.UniqueConstraint('session_code_id', 'date', 'branch', 'division', name='uix_daily_summary_key'),
+    )
+
+
+# Rollup of the days each student was present per month (month = first day)
+class AttendanceMonthlyStudent(db.Model):
+    __tablename__ = 'attendance_monthly_student'
+    id = db.Column(db.Integer, primary_key=True)
+    session_code_id = db.Column(db.Integer, db.ForeignKey('session_code.id'), nullable=False)
+    reg_id = db.Column(db.String(100), nullable=False)
+    month = db.Column(db.Date, nullable=False)
+    name = db.Column(db.String(100))
+    branch = db.Column(db.String(100), nullable=False, default='')
+    division = db.Column(db.String(10), nullable=False, default='')
+    days_present = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.UniqueConstraint('session_code_id', 'reg_id', 'month', name='uix_monthly_student_key'),
+        db.Index('ix_monthly_student_session_month', 'session_code_id', 'month'),
     )
 
 
@@ -55,6 +99,11 @@ class Users(db.Model, UserMixin):
     # Foreign key to link to session codes
     session_code_id = db.Column(db.Integer, db.ForeignKey('session_code.id'), nullable=False)
 
+    # Login looks users up by username (and session), registration by reg_id
+    __table_args__ = (
+        db.Index('ix_users_username_session', 'username', 'session_code_id'),
+        db.Index('ix_users_reg_id', 'reg_id'),
+    )
 
     def __repr__(self):
         return f'<User: {self.username}, Role: {self.role}>'
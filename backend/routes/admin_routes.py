@@ -1,21 +1,31 @@
-from flask import Blueprint, request, redirect, url_for, render_template, flash, session, current_app
+from flask import (Blueprint, request, redirect, url_for, render_template, flash, session, current_app,
+                   Response, send_file, stream_with_context)
 from flask_login import login_required, current_user
 from models import db, Student_data, Attendance, SessionCode
 from werkzeug.utils import secure_filename
 import os
-import csv
-import io
+import datetime
+import itertools
 import logging
-from utils.helpers import stop_camera, allowed_file
+import tempfile
+import zipfile
+from utils.encoding import DEFAULT_CHUNKSIZE, record_encodings, record_face_locations
+from utils.enrollment import enroll_students, extract_photos, read_roster_csv
+from utils.export import attendance_export_query, iter_rows, csv_chunks, write_parquet
+from utils.helpers import allowed_file
+from utils.preprocess import STAGING_FOLDER, PreprocessError, chip_path, preprocess_photo
+from utils.roster import roster_cache
+from utils.thumbnails import ensure_thumbnail, image_listing_cache, thumbnail_path
 
 admin_bp = Blueprint('admin_bp', __name__)
 
+MAX_FLASHED_PROBLEMS = 50
+
 
 @admin_bp.route('/data')
 @login_required
 def data():
     if current_user.role == 'admin':
-        stop_camera()
         return render_template('data.html')
     else:
         return 'UnAuthorized Access'
@@ -66,22 +76,68 @@ def add_user():
             session_folder = os.path.join(current_app.config['UPLOAD_FOLDER'], str(session['session_code_id']))
             os.makedirs(session_folder, exist_ok=True)
 
-            # Save the file into the session-specific subfolder
+            # The upload is staged outside the session folder, so neither the
+            # listing nor a concurrent rebuild sees it, and it replaces any
+            # photo of this regid only once the student is saved
+            from app import params, refresh_session_feeds
+            upload_folder = current_app.config['UPLOAD_FOLDER']
             filename = secure_filename(regid + '.' + file.filename.rsplit('.', 1)[1].lower())
             file_path = os.path.join(session_folder, filename)
-            file.save(file_path)
-
-            # Proceed to add the new student
-            user = Student_data(
-                name=name,
-                rollno=rollno,
-                division=division,
-                branch=branch,
-                regid=regid,
-                session_code_id=session['session_code_id']  # 🔐 Add this line
-            )
-            db.session.add(user)
-            db.session.commit()
+            chip_file = chip_path(upload_folder, session['session_code_id'], filename)
+            staging_folder = os.path.join(upload_folder, STAGING_FOLDER)
+            os.makedirs(staging_folder, exist_ok=True)
+            with tempfile.TemporaryDirectory(dir=staging_folder) as staging:
+                staged_path = os.path.join(staging, filename)
+                staged_chip = staged_path + '.png'
+                file.save(staged_path)
+
+                # Downsize and check for exactly one face before anything is recorded
+                try:
+                    _, location = preprocess_photo(staged_path, staged_chip, **params.get('enrollment', {}))
+                except Exception as e:
+                    if isinstance(e, PreprocessError):
+                        error_message = f"Photo rejected: {e}"
+                    else:
+                        print("Error:", e)
+                        error_message = 'Could not process the photo.'
+                    flash(error_message, 'error')
+                    return redirect(url_for('admin_bp.data'))
+
+                # Proceed to add the new student
+                user = Student_data(
+                    name=name,
+                    rollno=rollno,
+                    division=division,
+                    branch=branch,
+                    regid=regid,
+                    session_code_id=session['session_code_id']  # 🔐 Add this line
+                )
+                try:
+                    db.session.add(user)
+                    db.session.commit()
+                except Exception as e:
+                    db.session.rollback()
+                    print("Error:", e)
+                    flash('Error occurred while adding the student.', 'error')
+                    return redirect(url_for('admin_bp.data'))
+                os.replace(staged_path, file_path)
+                # The student is saved already, so a chip that could not be
+                # cut or moved is only logged
+                try:
+                    os.makedirs(os.path.dirname(chip_file), exist_ok=True)
+                    os.replace(staged_chip, chip_file)
+                except OSError as e:
+                    print("Error:", e)
+
+            # Remember where the face is, so encoding this photo skips detection
+            record_face_locations(session['session_code_id'], upload_folder, {filename: location})
+            image_listing_cache.invalidate(session_folder)
+            try:
+                ensure_thumbnail(file_path, thumbnail_path(upload_folder, session['session_code_id'], filename))
+            except Exception as e:
+                print("Error:", e)
+            roster_cache.invalidate(session['session_code_id'])
+            refresh_session_feeds(session['session_code_id'])
             error_message = 'Student added successfully!'
             flash('Student added successfully!', 'success')
             return render_template('data.html', error=error_message)
@@ -92,7 +148,78 @@ def add_user():
             return redirect(request.url)
 
 
-# Function to download the attendance of particular date in cvs format
+# Flash the first problems of a bulk import, then how many more there were
+def flash_problems(problems, limit=MAX_FLASHED_PROBLEMS):
+    for problem in problems[:limit]:
+        flash(problem, 'error')
+    if len(problems) > limit:
+        flash(f"... and {len(problems) - limit} more", 'error')
+
+
+# Bulk enrollment: a CSV of roster rows (name, rollno, division, branch, regid)
+# and a zip of photos named <regid>.jpg/.png. Photos are checked for exactly
+# one face in parallel, new students are inserted in one statement and only
+# their photos are encoded into the session gallery.
+@admin_bp.route('/bulk_enroll', methods=['POST'])
+@login_required
+def bulk_enroll():
+    if 'session_code_id' not in session:
+        flash('Session expired or unauthorized access.', 'error')
+        return redirect(url_for('auth_bp.login'))
+    if current_user.role != 'admin':
+        return 'UnAuthorized Access'
+
+    roster_file = request.files.get('roster')
+    photos_file = request.files.get('photos')
+    if not roster_file or roster_file.filename == '' or not photos_file or photos_file.filename == '':
+        flash('Both a roster CSV and a photo archive are required.', 'error')
+        return redirect(url_for('admin_bp.data'))
+
+    from app import params, refresh_session_gallery
+
+    session_code_id = session['session_code_id']
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    rows, errors = read_roster_csv(roster_file.stream)
+    problems = [f"Line {line}: {reason}" for line, reason in errors]
+    if not rows:
+        flash_problems(problems)
+        flash('No students to enroll.', 'error')
+        return redirect(url_for('admin_bp.data'))
+
+    try:
+        with tempfile.TemporaryDirectory() as staging:
+            try:
+                photos, photo_errors = extract_photos(photos_file.stream, {row['regid'] for row in rows}, staging)
+            except zipfile.BadZipFile:
+                flash('The photo archive is not a valid zip file.', 'error')
+                return redirect(url_for('admin_bp.data'))
+            problems += [f"{member}: {reason}" for member, reason in photo_errors]
+
+            enrolled, encodings, rejected = enroll_students(
+                db, Student_data, session_code_id, rows, photos, upload_folder,
+                workers=params.get('encoding_workers') or None,
+                chunksize=params.get('encoding_chunksize', DEFAULT_CHUNKSIZE),
+                preprocess=params.get('enrollment', {}))
+        problems += [f"{regid}: {reason}" for regid, reason in rejected]
+        flash_problems(problems)
+
+        if enrolled:
+            roster_cache.invalidate(session_code_id)
+            image_listing_cache.invalidate(os.path.join(upload_folder, str(session_code_id)))
+            record_encodings(session_code_id, upload_folder, encodings)
+            refresh_session_gallery(session_code_id)
+        error_message = f"{len(enrolled)} students enrolled, {len(rejected) + len(errors)} rejected"
+        flash(error_message, 'success')
+    except Exception as e:
+        db.session.rollback()
+        print("Error:", e)
+        error_message = 'Error occurred while enrolling students.'
+        flash(error_message, 'error')
+    return render_template('data.html', error=error_message)
+
+
+# Function to download the attendance of a date range in csv (or parquet) format.
+# Rows are streamed from a server-side cursor, so long ranges stay within memory.
 @admin_bp.route('/download_attendance_csv', methods=['POST'])
 def download_attendance_csv():
     if 'session_code_id' not in session:
@@ -100,38 +227,49 @@ def download_attendance_csv():
         return redirect(url_for('auth_bp.login'))
 
     try:
-        # Assuming the date is submitted via a form
-        date = request.form.get('date')
-        if not date:
+        # A single 'date' still works; 'start_date'/'end_date' select a range
+        start_date = request.form.get('start_date') or request.form.get('date')
+        end_date = request.form.get('end_date') or start_date
+        if not start_date:
             flash("Date not provided for downloading.")
             return redirect(url_for('general_bp.get_attendance'))
-
-        # Retrieve attendance records for the specified date
-        attendance_records = Attendance.query.filter_by(
-            date=date,
-            session_code_id=session['session_code_id']
-        ).all()
-        if not attendance_records:
-            flash("No attendance records found for the specified date.")
+        try:
+            start_date = datetime.date.fromisoformat(start_date)
+            end_date = datetime.date.fromisoformat(end_date)
+        except ValueError:
+            flash("Invalid date.")
             return redirect(url_for('general_bp.get_attendance'))
-
-        # Create a CSV string
-        output = io.StringIO()
-        writer = csv.writer(output)
-        writer.writerow(['Name', 'Start Time', 'End Time', 'Date',
-                        'Roll Number', 'Division', 'Branch', 'Registration ID'])
-        for record in attendance_records:
-            writer.writerow([record.name, record.start_time, record.end_time, record.date,
-                            record.roll_no, record.division, record.branch, record.reg_id])
-        
-        # Set the response headers for CSV download
-        from flask import Response
+        branch = request.form.get('branch') or None
+        division = request.form.get('division') or None
+        export_format = request.form.get('format', 'csv')
 
         session_id = session['session_code_id']
-        filename = f"attendance_records_{session_id}_{date}.csv"
+        query = attendance_export_query(Attendance, session_id, start_date, end_date, branch, division)
+        partitions = iter_rows(db, query)
+        first = next(partitions, None)
+        if first is None:
+            flash("No attendance records found for the specified dates.")
+            return redirect(url_for('general_bp.get_attendance'))
+        partitions = itertools.chain([first], partitions)
+
+        period = f"{start_date}" if start_date == end_date else f"{start_date}_{end_date}"
+        if export_format == 'parquet':
+            # Parquet needs the whole file before it can be sent; it is
+            # written to disk, not memory
+            output = tempfile.TemporaryFile()
+            try:
+                write_parquet(partitions, output)
+            except ImportError:
+                output.close()
+                flash("Parquet export needs the pyarrow package; download CSV instead.")
+                return redirect(url_for('general_bp.get_attendance'))
+            output.seek(0)
+            return send_file(output, mimetype='application/vnd.apache.parquet', as_attachment=True,
+                             download_name=f"attendance_records_{session_id}_{period}.parquet")
 
+        filename = f"attendance_records_{session_id}_{period}.csv"
         return Response(
-            output.getvalue(),
+            stream_with_context(csv_chunks(partitions)),
             mimetype='text/csv',
             headers={
                 "Content-Disposition": f"attachment; filename={filename}"
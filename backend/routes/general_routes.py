@@ -1,12 +1,41 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, send_from_directory, session, current_app
+from flask import (Blueprint, render_template, request, redirect, url_for, flash, send_file,
+                   session, current_app, jsonify, abort)
 from flask_login import login_required, current_user
-from sqlalchemy import asc
-from models import Attendance, Student_data, Users, db, SessionCode
-from utils.helpers import stop_camera
-import datetime, csv, os, logging, io
+from models import Attendance, db
+import datetime, os
+from werkzeug.security import safe_join
+from utils.thumbnails import (
+    DEFAULT_IMAGES_PER_PAGE,
+    DEFAULT_THUMBNAIL_SIZE,
+    IMMUTABLE_MAX_AGE,
+    MAX_IMAGES_PER_PAGE,
+    THUMBNAIL_SIZES,
+    ensure_thumbnail,
+    image_listing_cache,
+    thumbnail_path,
+)
+from utils.pagination import (
+    DEFAULT_PAGE_SIZE,
+    FILTER_COLUMNS,
+    attendance_filters,
+    attendance_row,
+    attendance_summary,
+    keyset_page,
+)
 
 general_bp = Blueprint('general_bp', __name__)
 
+# Page of attendance rows for the current request's ?sort=&order=&after=&limit=
+def attendance_page(filters, default_sort='date', default_order='asc'):
+    return keyset_page(
+        db, Attendance, filters,
+        sort=request.args.get('sort', default_sort),
+        order=request.args.get('order', default_order),
+        after=request.args.get('after'),
+        limit=request.args.get('limit', DEFAULT_PAGE_SIZE, type=int),
+    )
+
+
 @general_bp.route('/profile', methods=['GET', 'POST'])
 def profile():
     if 'session_code_id' not in session:
@@ -18,12 +47,14 @@ def profile():
         if hasattr(current_user, 'reg_id'):
             reg_id = current_user.reg_id
 
-        data = Attendance.query.filter_by(
-            reg_id=reg_id,
-            session_code_id=session['session_code_id']
-        ).all()
-        no_of_attendance = len(data)
-        return render_template('profile.html', data=data, no_of_attendance=no_of_attendance)
+        filters = attendance_filters(Attendance, session['session_code_id'], {'reg_id': reg_id})
+        try:
+            page = attendance_page(filters, 'date', 'desc')
+        except ValueError as e:
+            return str(e), 400
+        no_of_attendance = attendance_summary(db, Attendance, filters)['total']
+        return render_template('profile.html', data=page.rows, page=page, no_of_attendance=no_of_attendance,
+                               api_args={'reg_id': reg_id})
     
 
 # Route which displays the attendance of all student for that current day
@@ -34,7 +65,6 @@ def display_attendance():
         flash('Session expired or unauthorized access.', 'error')
         return redirect(url_for('auth_bp.login'))
 
-    stop_camera()
     current_date = datetime.datetime.now().date()
     try:
         input_date = None
@@ -47,17 +77,9 @@ def display_attendance():
 
         # STUDENT: see only their own attendance
         if current_user.role == 'student':
-            name = session['username']
-            username = session.get('username')
-            user = Users.query.filter_by(username=username).first()
-            if user:
-                data = Attendance.query.filter_by(
-                    date=date,
-                    reg_id=user.reg_id,
-                    session_code_id=session['session_code_id']
-                ).all()
-            else:
-                data = []
+            filters = attendance_filters(Attendance, session['session_code_id'],
+                                         {'date': date, 'reg_id': current_user.reg_id})
+            data = attendance_page(filters).rows
         else:
             # Fallback (shouldn’t trigger)
             data = []
@@ -75,27 +97,22 @@ def get_attendance():
         return redirect(url_for('auth_bp.login'))
 
     if current_user.role == 'teacher':
-        stop_camera()
-
         try:
             date_filter = request.form.get('date') if request.method == 'POST' else None
-            query_parameters = {key: value for key, value in request.args.items() if value}
-            query_parameters['session_code_id'] = session['session_code_id']
-
+            # Only known filter columns are taken from the query string
+            query_parameters = {key: request.args[key] for key in FILTER_COLUMNS + ('start_date', 'end_date')
+                                if request.args.get(key)}
             if date_filter:
-                # Get all attendance records on selected date
-                attendance_records = Attendance.query.filter_by(
-                    date=date_filter,
-                    session_code_id=session['session_code_id']
-                ).order_by(asc(Attendance.reg_id)).all()
-            elif query_parameters:
-                # Use filters if provided
-                attendance_records = Attendance.query.filter_by(**query_parameters).order_by(asc(Attendance.reg_id)).all()
-            else:
-                attendance_records = []
-                flash("No parameters provided for query", "warning")
-
-            return render_template('results.html', attendance_records=attendance_records, date=date_filter)
+                query_parameters = {'date': date_filter}
+
+            # One page of the session's records (narrowed by any filters), in
+            # the (date, id) order the listing index returns unless asked otherwise
+            filters = attendance_filters(Attendance, session['session_code_id'], query_parameters)
+            page = attendance_page(filters, 'date', 'asc')
+            summary = attendance_summary(db, Attendance, filters)
+
+            return render_template('results.html', attendance_records=page.rows, page=page,
+                                   summary=summary, api_args=query_parameters, date=date_filter)
 
         except Exception as e:
             return str(e)
@@ -103,6 +120,43 @@ def get_attendance():
         return 'Unauthorized access'
 
 
+# Filters an API caller may use: students only ever see their own rows
+def api_filters():
+    args = request.args.to_dict()
+    if current_user.role == 'student':
+        args['reg_id'] = current_user.reg_id
+    return attendance_filters(Attendance, session['session_code_id'], args)
+
+
+# JSON pages of attendance for the templates to load lazily,
+# e.g. /api/attendance?date=2024-04-02&sort=reg_id&after=<cursor>
+@general_bp.route('/api/attendance')
+@login_required
+def api_attendance():
+    if 'session_code_id' not in session:
+        return jsonify({'error': 'Session expired or unauthorized access.'}), 401
+    try:
+        page = attendance_page(api_filters(), request.args.get('sort', 'date'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({
+        'rows': [attendance_row(record) for record in page.rows],
+        'next': page.next_cursor,
+        'sort': page.sort,
+        'order': page.order,
+        'limit': page.limit,
+    })
+
+
+# Total and per-day counts for the same filters
+@general_bp.route('/api/attendance/summary')
+@login_required
+def api_attendance_summary():
+    if 'session_code_id' not in session:
+        return jsonify({'error': 'Session expired or unauthorized access.'}), 401
+    return jsonify(attendance_summary(db, Attendance, api_filters()))
+
+
 @general_bp.route('/images')
 @login_required
 def images():
@@ -112,20 +166,60 @@ def images():
 
     if current_user.role == 'admin':
         session_folder = os.path.join(current_app.config['UPLOAD_FOLDER'], str(session['session_code_id']))
-        image_files = []
-        if os.path.exists(session_folder):
-            image_files = [f for f in os.listdir(session_folder) if os.path.isfile(os.path.join(session_folder, f))]
+        image_files = image_listing_cache.get(session_folder)
         image_no = len(image_files)
-        print(f"No of images: {image_no}")
-        return render_template('image_gallery.html', image_files=image_files, image_no=image_no)
+        # One page of thumbnails at a time, ?page=2&per_page=60
+        per_page = max(1, min(request.args.get('per_page', DEFAULT_IMAGES_PER_PAGE, type=int), MAX_IMAGES_PER_PAGE))
+        pages = max(1, -(-image_no // per_page))
+        page = max(1, min(request.args.get('page', 1, type=int), pages))
+        page_files = image_files[(page - 1) * per_page:page * per_page]
+        return render_template('image_gallery.html', image_files=page_files, image_no=image_no,
+                               page=page, pages=pages, per_page=per_page)
     else:
         return 'Unauthourized access'
 
 
+# Send an image with validators. URLs carrying the file's mtime (?v=) are
+# cached by the browser for good; others are revalidated with a conditional
+# GET and answered 304 when unchanged. Images are private to the session.
+def cached_image_response(path, versioned):
+    response = send_file(path, conditional=True, etag=True, max_age=IMMUTABLE_MAX_AGE if versioned else 0)
+    response.cache_control.public = False
+    response.cache_control.private = True
+    if not versioned:
+        response.cache_control.no_cache = True
+    return response
+
+
+# Path of an uploaded image of the current session, or a 403/404 abort
+def session_image_path(folder, filename):
+    if str(folder) != str(session.get('session_code_id')):
+        abort(403)
+    path = safe_join(os.path.join(current_app.config['UPLOAD_FOLDER'], folder), filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    return path
+
+
 @general_bp.route('/uploads/<folder>/<filename>')
 @login_required
 def get_image(folder, filename):
-    if str(folder) != str(session['session_code_id']):
-        return "Unauthorized access", 403
-    folder_path = os.path.join(current_app.config['UPLOAD_FOLDER'], folder)
-    return send_from_directory(folder_path, filename)
+    path = session_image_path(folder, filename)
+    return cached_image_response(path, 'v' in request.args)
+
+
+# Downsized JPEG of an uploaded image, generated on first request and
+# regenerated when the original changes: /thumbnails/<folder>/<filename>?size=320
+@general_bp.route('/thumbnails/<folder>/<filename>')
+@login_required
+def get_thumbnail(folder, filename):
+    path = session_image_path(folder, filename)
+    size = request.args.get('size', DEFAULT_THUMBNAIL_SIZE, type=int)
+    if size not in THUMBNAIL_SIZES:
+        size = DEFAULT_THUMBNAIL_SIZE
+    try:
+        thumb = ensure_thumbnail(path, thumbnail_path(current_app.config['UPLOAD_FOLDER'], folder, filename, size), size)
+    except Exception as e:
+        print("Error:", e)
+        abort(404)
+    return cached_image_response(thumb, 'v' in request.args)
@@ -0,0 +1,85 @@
+from flask import Blueprint, request, session, jsonify
+from flask_login import login_required, current_user
+from models import db
+import datetime
+from utils.rollups import DEFAULT_REPORT_LIMIT, branch_report, daily_report, student_report
+
+report_bp = Blueprint('report_bp', __name__)
+
+# Reports read only the rollup tables, never the attendance rows themselves,
+# so they cost the same however much history a session has.
+
+
+def parse_date(value):
+    return datetime.date.fromisoformat(value) if value else None
+
+
+# Accepts YYYY-MM or any day of the month
+def parse_month(value):
+    if not value:
+        return None
+    if len(value) == 7:
+        value += '-01'
+    return datetime.date.fromisoformat(value).replace(day=1)
+
+
+# JSON error for callers that are not a teacher or admin of a live session
+def report_access_error():
+    if 'session_code_id' not in session:
+        return jsonify({'error': 'Session expired or unauthorized access.'}), 401
+    if current_user.role not in ('teacher', 'admin'):
+        return jsonify({'error': 'Unauthorized access'}), 403
+    return None
+
+
+# Students present per day: /reports/daily?start_date=&end_date=&branch=&division=
+@report_bp.route('/reports/daily')
+@login_required
+def report_daily():
+    error = report_access_error()
+    if error:
+        return error
+    try:
+        days = daily_report(db, session['session_code_id'],
+                            parse_date(request.args.get('start_date')), parse_date(request.args.get('end_date')),
+                            request.args.get('branch'), request.args.get('division'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'days': days})
+
+
+# Presence per branch and division: /reports/branches?start_date=&end_date=
+@report_bp.route('/reports/branches')
+@login_required
+def report_branches():
+    error = report_access_error()
+    if error:
+        return error
+    try:
+        branches = branch_report(db, session['session_code_id'],
+                                 parse_date(request.args.get('start_date')), parse_date(request.args.get('end_date')))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'branches': branches})
+
+
+# Days present per student over whole months:
+# /reports/students?start_month=2024-01&end_month=2024-03&branch=&division=&after=<reg_id>&limit=
+@report_bp.route('/reports/students')
+@login_required
+def report_students():
+    error = report_access_error()
+    if error:
+        return error
+    try:
+        this_month = datetime.date.today().replace(day=1)
+        start_month = parse_month(request.args.get('start_month')) or this_month
+        end_month = parse_month(request.args.get('end_month')) or start_month
+        report = student_report(db, session['session_code_id'], start_month, end_month,
+                                request.args.get('branch'), request.args.get('division'),
+                                after=request.args.get('after'),
+                                limit=request.args.get('limit', DEFAULT_REPORT_LIMIT, type=int))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    report.update(start_month=start_month.isoformat(), end_month=end_month.isoformat())
+    return jsonify(report)
@@ -0,0 +1,200 @@
+import hashlib
+import os
+
+import numpy as np
+
+from utils.gallery import DEFAULT_TOLERANCE, ENCODING_DIM, load_gallery
+
+DEFAULT_NPROBE = 8
+DEFAULT_KMEANS_ITERATIONS = 10
+# Below this many identities an exact scan is already well under a millisecond
+DEFAULT_MIN_IDENTITIES = 20000
+# k-means is trained on a sample of this many vectors per list
+DEFAULT_TRAIN_PER_LIST = 64
+IVF_VERSION = 1
+
+_ASSIGN_CHUNK = 8192
+
+
+# Path of the ANN index stored next to a gallery file
+def ann_file_path(gallery_path):
+    return os.path.splitext(gallery_path)[0] + '.ivf'
+
+
+# Identifies the gallery an index was built for, so a stale index is ignored
+def gallery_digest(student_ids):
+    return hashlib.sha1('\n'.join(map(str, student_ids)).encode('utf-8')).hexdigest()
+
+
+def default_nlist(count):
+    return max(1, min(count, int(round(4 * np.sqrt(count)))))
+
+
+# Index of the nearest centroid for every vector, computed in chunks so the
+# distance matrix stays small
+def _nearest_centroids(vectors, centroids):
+    centroid_norms = np.einsum('ij,ij->i', centroids, centroids)
+    labels = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), _ASSIGN_CHUNK):
+        chunk = np.asarray(vectors[start:start + _ASSIGN_CHUNK], dtype=np.float32)
+        # |v|^2 is the same for every centroid, so it does not change the argmin
+        labels[start:start + len(chunk)] = np.argmin(centroid_norms[None, :] - 2.0 * (chunk @ centroids.T), axis=1)
+    return labels
+
+
+# Plain Lloyd's k-means on a random sample of the vectors
+def kmeans(vectors, nlist, iterations=DEFAULT_KMEANS_ITERATIONS, seed=0,
+           train_per_list=DEFAULT_TRAIN_PER_LIST):
+    rng = np.random.default_rng(seed)
+    count = len(vectors)
+    train_size = min(count, nlist * train_per_list)
+    train = np.asarray(vectors[np.sort(rng.choice(count, train_size, replace=False))], dtype=np.float32)
+    centroids = train[rng.choice(train_size, nlist, replace=False)].copy()
+
+    for _ in range(iterations):
+        labels = _nearest_centroids(train, centroids)
+        sizes = np.bincount(labels, minlength=nlist)
+        sums = np.stack([np.bincount(labels, weights=train[:, d], minlength=nlist)
+                         for d in range(train.shape[1])], axis=1)
+        filled = sizes > 0
+        centroids[filled] = sums[filled] / sizes[filled, None]
+        # Empty lists restart from random training vectors
+        empty = np.flatnonzero(~filled)
+        if len(empty):
+            centroids[empty] = train[rng.choice(train_size, len(empty), replace=False)]
+    return centroids
+
+
+# Inverted-file (IVF) index over a gallery. Encodings are partitioned by
+# k-means; a lookup only scans the `nprobe` lists whose centroids are closest
+# to the face and re-ranks those candidates with exact distances, so results
+# within the probed lists are identical to GalleryIndex. It exposes the same
+# lookup interface as GalleryIndex and can replace it transparently.
+class IvfIndex:
+    def __init__(self, gallery, centroids, order, offsets, nprobe=DEFAULT_NPROBE):
+        self.gallery = gallery
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.order = np.asarray(order)        # gallery rows grouped by list
+        self.offsets = np.asarray(offsets)    # list i is order[offsets[i]:offsets[i + 1]]
+        self.nprobe = nprobe
+        self._centroid_norms = np.einsum('ij,ij->i', self.centroids, self.centroids)
+
+    def __len__(self):
+        return len(self.gallery)
+
+    @property
+    def nlist(self):
+        return len(self.centroids)
+
+    @property
+    def student_ids(self):
+        return self.gallery.student_ids
+
+    @property
+    def nbytes(self):
+        return self.gallery.nbytes + self.centroids.nbytes + self.order.nbytes + self.offsets.nbytes
+
+    # Gallery rows in the nprobe lists closest to each face
+    def candidates(self, faces, nprobe=None):
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        scores = self._centroid_norms[None, :] - 2.0 * (faces @ self.centroids.T)
+        if nprobe < self.nlist:
+            probes = np.argpartition(scores, nprobe - 1, axis=1)[:, :nprobe]
+        else:
+            probes = np.tile(np.arange(self.nlist), (len(faces), 1))
+        return [
+            np.concatenate([self.order[self.offsets[c]:self.offsets[c + 1]] for c in row])
+            for row in probes
+        ]
+
+    # Top-k (student_id, distance) pairs within tolerance for each face, closest first
+    def match(self, face_encodings, tolerance=DEFAULT_TOLERANCE, k=1, nprobe=None):
+        if len(face_encodings) == 0:
+            return []
+        faces = np.asarray(face_encodings, dtype=np.float32).reshape(-1, ENCODING_DIM)
+        if len(self) == 0:
+            return [[] for _ in range(len(faces))]
+
+        matrix, norms = self.gallery.matrix, self.gallery.norms
+        results = []
+        for face, rows in zip(faces, self.candidates(faces, nprobe)):
+            if len(rows) == 0:
+                results.append([])
+                continue
+            rows = np.sort(rows)  # sequential reads from the memmap
+            squared = float(face @ face) + norms[rows] - 2.0 * (matrix[rows] @ face)
+            dist = np.sqrt(np.maximum(squared, 0.0))
+            top = min(k, len(rows))
+            best = np.argpartition(dist, top - 1)[:top] if top < len(rows) else np.arange(len(rows))
+            best = best[np.argsort(dist[best])]
+            results.append([
+                (self.gallery.student_ids[rows[i]], float(dist[i]))
+                for i in best if dist[i] <= tolerance
+            ])
+        return results
+
+    def best_matches(self, face_encodings, tolerance=DEFAULT_TOLERANCE):
+        return [found[0][0] if found else None
+                for found in self.match(face_encodings, tolerance, k=1)]
+
+
+# Partition a gallery into nlist k-means lists
+def build_ivf(gallery, nlist=None, iterations=DEFAULT_KMEANS_ITERATIONS, seed=0, nprobe=DEFAULT_NPROBE):
+    nlist = min(nlist or default_nlist(len(gallery)), len(gallery))
+    centroids = kmeans(gallery.matrix, nlist, iterations, seed)
+    labels = _nearest_centroids(gallery.matrix, centroids)
+    order = np.argsort(labels, kind='stable').astype(np.int32)
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(labels, minlength=nlist))]).astype(np.int64)
+    return IvfIndex(gallery, centroids, order, offsets, nprobe)
+
+
+# Write an index next to its gallery, atomically like save_gallery
+def save_ivf(path, index):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as file:
+        np.savez(file, version=IVF_VERSION, count=len(index), digest=gallery_digest(index.student_ids),
+                 centroids=index.centroids, order=index.order, offsets=index.offsets)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
+
+
+# Load the index of a gallery, or None when it is missing or was built for
+# a different version of the gallery
+def load_ivf(path, gallery, nprobe=DEFAULT_NPROBE):
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as data:
+        if (int(data['version']) != IVF_VERSION or int(data['count']) != len(gallery)
+                or str(data['digest']) != gallery_digest(gallery.student_ids)):
+            print(f"Ignoring stale ANN index: {path}")
+            return None
+        return IvfIndex(gallery, data['centroids'], data['order'], data['offsets'], nprobe)
+
+
+# Gallery loader for GalleryCache: the IVF index when one was built, else the exact gallery
+def load_gallery_with_ann(path, nprobe=DEFAULT_NPROBE):
+    gallery = load_gallery(path)
+    try:
+        index = load_ivf(ann_file_path(path), gallery, nprobe)
+    except Exception as e:
+        print("Error loading ANN index:", e)
+        index = None
+    return gallery if index is None else index
+
+
+# Build (or remove) the ANN index of a freshly written gallery according to
+# the "ann" config block. Returns the index, or None when exact search is used.
+def update_ann_index(gallery_path, config=None):
+    config = config or {}
+    path = ann_file_path(gallery_path)
+    gallery = load_gallery(gallery_path)
+    if not config.get('enabled') or len(gallery) < config.get('min_identities', DEFAULT_MIN_IDENTITIES):
+        if os.path.exists(path):
+            os.remove(path)
+        return None
+    index = build_ivf(gallery, nlist=config.get('nlist'),
+                      iterations=config.get('iterations', DEFAULT_KMEANS_ITERATIONS),
+                      nprobe=config.get('nprobe', DEFAULT_NPROBE))
+    save_ivf(path, index)
+    return index
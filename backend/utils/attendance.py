@@ -0,0 +1,227 @@
+import atexit
+import queue
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import func, tuple_
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
+
+from utils.metrics import attendance_rows_total, attendance_write_errors, attendance_write_seconds
+from utils.rollups import existing_attendance_keys, update_rollups
+
+DEFAULT_FLUSH_INTERVAL = 1.0
+DEFAULT_QUEUE_SIZE = 10000
+
+_STOP = object()
+
+_write_seconds = attendance_write_seconds.labels('batch')
+_write_errors = attendance_write_errors.labels('batch')
+_rows_written = attendance_rows_total.labels('batch')
+
+
+# Background writer for attendance sightings. Recognized faces are queued
+# from the frame loop and coalesced per (reg_id, date, session) so each flush
+# touches every student at most once, in a single transaction.
+class AttendanceRecorder:
+    def __init__(self, flush_interval=DEFAULT_FLUSH_INTERVAL, max_queue=DEFAULT_QUEUE_SIZE):
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.dropped = 0
+        self.flushes = 0
+        self.errors = 0
+        self.rows_written = 0
+        self.last_flush_rows = 0
+        self.last_flush_seconds = 0.0
+        self._queue = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def stats(self):
+        return {
+            'queue_depth': self.queue_depth,
+            'dropped': self.dropped,
+            'flushes': self.flushes,
+            'errors': self.errors,
+            'rows_written': self.rows_written,
+            'last_flush_rows': self.last_flush_rows,
+            'last_flush_seconds': self.last_flush_seconds,
+        }
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._queue = queue.Queue(maxsize=self.max_queue)
+            self._thread = threading.Thread(target=self._run, name='attendance-recorder', daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    # Flush everything still queued and stop the writer thread
+    def stop(self, timeout=10):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        self._queue.put(_STOP)
+        thread.join(timeout)
+
+    # Queue a sighting; never blocks the frame loop
+    def record(self, name, current_date, roll_no, div, branch, reg_id, session_code_id):
+        if self._thread is None:
+            self.start()
+        seen_at = datetime.now().strftime("%H:%M:%S")
+        try:
+            self._queue.put_nowait((name, current_date, roll_no, div, branch, reg_id, session_code_id, seen_at))
+        except queue.Full:
+            # The same face is seen again on the next frame, so dropping is safe
+            self.dropped += 1
+
+    def _run(self):
+        running = True
+        while running:
+            pending = {}
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                try:
+                    event = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if event is _STOP:
+                    running = False
+                    break
+                self._coalesce(pending, event)
+            # Drain whatever arrived while stopping
+            if not running:
+                while True:
+                    try:
+                        event = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if event is not _STOP:
+                        self._coalesce(pending, event)
+            if pending:
+                self.flush(pending)
+
+    @staticmethod
+    def _coalesce(pending, event):
+        name, current_date, roll_no, div, branch, reg_id, session_code_id, seen_at = event
+        key = (reg_id, current_date, session_code_id)
+        entry = pending.get(key)
+        if entry is None:
+            pending[key] = {
+                'name': name, 'roll_no': roll_no, 'division': div, 'branch': branch,
+                'reg_id': reg_id, 'date': current_date, 'session_code_id': session_code_id,
+                'start_time': seen_at, 'end_time': seen_at,
+            }
+        else:
+            entry['end_time'] = max(entry['end_time'], seen_at)
+
+    # Write one batch of coalesced sightings
+    def flush(self, pending):
+        from app import db, Attendance, app
+
+        started = time.perf_counter()
+        rows = list(pending.values())
+        try:
+            with app.app_context():
+                try:
+                    upsert_attendance(db, Attendance, rows)
+                except IntegrityError:
+                    # One conflicting row must not cost the whole batch
+                    db.session.rollback()
+                    for row in rows:
+                        try:
+                            upsert_attendance(db, Attendance, [row])
+                        except Exception as e:
+                            db.session.rollback()
+                            self.errors += 1
+                            _write_errors.inc()
+                            print("Error:", e)
+            self.rows_written += len(rows)
+            _rows_written.inc(len(rows))
+        except Exception as e:
+            self.errors += 1
+            _write_errors.inc()
+            print("Error:", e)
+        self.flushes += 1
+        self.last_flush_rows = len(rows)
+        self.last_flush_seconds = time.perf_counter() - started
+        _write_seconds.observe(self.last_flush_seconds)
+
+
+# Insert new attendance rows and widen start_time/end_time of existing ones
+# (live sightings only ever move end_time; offline backfills can be earlier).
+# MySQL/MariaDB and SQLite do this in one atomic statement against the
+# uix_session_reg_date key; other databases fall back to one SELECT for the
+# whole batch followed by bulk UPDATE/INSERT. Either way it is one commit.
+# Rows that did not exist yet are added to the reporting rollups in the same
+# transaction. With several writer processes a row inserted by another
+# process between the key lookup and the upsert can be counted twice;
+# `flask --app app rollup-backfill` recomputes the rollups from attendance.
+def upsert_attendance(db, Attendance, rows):
+    existing = existing_attendance_keys(db, Attendance, rows)
+    new_rows = [row for row in rows
+                if (row['reg_id'], row['date'], row['session_code_id']) not in existing]
+    dialect = db.session.get_bind().dialect.name
+    if dialect in ('mysql', 'mariadb'):
+        stmt = mysql_insert(Attendance).values(rows)
+        stmt = stmt.on_duplicate_key_update(
+            start_time=func.least(func.coalesce(Attendance.start_time, stmt.inserted.start_time),
+                                  stmt.inserted.start_time),
+            end_time=func.greatest(func.coalesce(Attendance.end_time, stmt.inserted.end_time),
+                                   stmt.inserted.end_time))
+        db.session.execute(stmt)
+    elif dialect == 'sqlite':
+        stmt = sqlite_insert(Attendance).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['session_code_id', 'reg_id', 'date'],
+            set_={
+                'start_time': func.min(func.coalesce(Attendance.start_time, stmt.excluded.start_time),
+                                       stmt.excluded.start_time),
+                'end_time': func.max(func.coalesce(Attendance.end_time, stmt.excluded.end_time),
+                                     stmt.excluded.end_time),
+            })
+        db.session.execute(stmt)
+    else:
+        _select_then_write(db, Attendance, rows)
+    update_rollups(db, new_rows)
+    db.session.commit()
+
+
+def _select_then_write(db, Attendance, rows):
+    keys = [(row['reg_id'], row['date'], row['session_code_id']) for row in rows]
+    existing = {
+        (reg_id, date, session_code_id): (id_, start_time, end_time)
+        for id_, reg_id, date, session_code_id, start_time, end_time in db.session.query(
+            Attendance.id, Attendance.reg_id, Attendance.date,
+            Attendance.session_code_id, Attendance.start_time, Attendance.end_time,
+        ).filter(
+            tuple_(Attendance.reg_id, Attendance.date, Attendance.session_code_id).in_(keys)
+        )
+    }
+
+    updates = []
+    inserts = []
+    for key, row in zip(keys, rows):
+        if key in existing:
+            id_, start_time, end_time = existing[key]
+            start_time = min(start_time or row['start_time'], row['start_time'])
+            end_time = max(end_time or row['end_time'], row['end_time'])
+            updates.append({'id': id_, 'start_time': start_time, 'end_time': end_time})
+        else:
+            inserts.append(row)
+
+    if updates:
+        db.session.execute(db.update(Attendance), updates)
+    if inserts:
+        db.session.execute(db.insert(Attendance), inserts)
+
+
+attendance_recorder = AttendanceRecorder()
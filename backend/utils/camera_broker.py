@@ -0,0 +1,193 @@
+import atexit
+import threading
+import time
+
+import cv2
+
+from utils.pipeline import FramePipeline, DEFAULT_MAX_BACKOFF
+from utils.scheduler import DEFAULT_TARGET_FPS
+
+DEFAULT_IDLE_TIMEOUT = 30.0
+
+
+class CameraBusyError(Exception):
+    pass
+
+
+# Configured cameras keyed by id. Reads the "cameras" list from config.json,
+# falling back to the older camera_index_1 / camera_index_2 keys.
+def camera_configs(params):
+    cameras = params.get('cameras')
+    if not cameras:
+        cameras = [
+            {'id': number, 'source': params[f'camera_index_{number}']}
+            for number in (1, 2) if f'camera_index_{number}' in params
+        ]
+    return {int(camera['id']): camera for camera in cameras}
+
+
+# One open camera with its recognition pipeline, shared by all its viewers
+class CameraFeed:
+    def __init__(self, camera_id, source, session_code_id, pipeline):
+        self.camera_id = camera_id
+        self.source = source
+        self.session_code_id = str(session_code_id)
+        self.pipeline = pipeline
+        self.subscribers = 0
+        self.idle_since = time.monotonic()
+
+
+# Supervises the configured cameras: owns exactly one capture and one
+# recognition loop per camera and fans the annotated frames out to any number
+# of MJPEG viewers. Captures reconnect with backoff on failure, recognition
+# runs on the shared inference scheduler, and cameras nobody has watched for
+# idle_timeout seconds are stopped and released.
+class CameraBroker:
+    def __init__(self, create_recognizer, cameras, scheduler=None, open_camera=cv2.VideoCapture,
+                 idle_timeout=DEFAULT_IDLE_TIMEOUT, target_fps=DEFAULT_TARGET_FPS,
+                 max_backoff=DEFAULT_MAX_BACKOFF, output_settings=None):
+        self.create_recognizer = create_recognizer
+        self.cameras = cameras
+        self.scheduler = scheduler
+        self.open_camera = open_camera
+        self.idle_timeout = idle_timeout
+        self.target_fps = target_fps
+        self.max_backoff = max_backoff
+        self.output_settings = output_settings or {}
+        self._feeds = {}
+        self._lock = threading.Lock()
+        self._camera_locks = {}
+        self._reaper = None
+        self._stop = threading.Event()
+
+    # Join the feed of a camera, starting it if needed. Returns None when the
+    # session has no encodings; raises KeyError for unknown cameras and
+    # CameraBusyError when the camera is being watched for another session.
+    # An idle feed of another session is stopped and replaced.
+    def subscribe(self, camera_id, session_code_id):
+        config = self.cameras[camera_id]
+        # Starts are serialized per camera; self._lock only guards the feed
+        # table, so loading a gallery never stalls health checks or metrics
+        with self._camera_lock(camera_id):
+            with self._lock:
+                feed = self._feeds.get(camera_id)
+                if feed is not None:
+                    if feed.session_code_id == str(session_code_id):
+                        feed.subscribers += 1
+                        self._start_reaper()
+                        return feed
+                    if feed.subscribers > 0:
+                        raise CameraBusyError(f"Camera {camera_id} is in use by another session")
+                    del self._feeds[camera_id]
+            if feed is not None:
+                self._close(feed)
+
+            recognizer = self.create_recognizer(session_code_id, config)
+            if recognizer is None:
+                return None
+            pipeline = FramePipeline(config['source'], recognizer, open_camera=self.open_camera,
+                                     scheduler=self.scheduler, max_backoff=self.max_backoff,
+                                     output_settings={**self.output_settings, **config.get('stream', {})})
+            if self.scheduler is not None:
+                self.scheduler.register(camera_id, pipeline, config.get('target_fps', self.target_fps))
+            pipeline.start()
+            feed = CameraFeed(camera_id, config['source'], session_code_id, pipeline)
+            feed.subscribers = 1
+            with self._lock:
+                self._feeds[camera_id] = feed
+                self._start_reaper()
+            print(f"Camera {camera_id} started for session {session_code_id}")
+            return feed
+
+    def _camera_lock(self, camera_id):
+        with self._lock:
+            return self._camera_locks.setdefault(camera_id, threading.Lock())
+
+    # Hand a session's new gallery and/or roster to the feeds recognizing for
+    # it, which otherwise keep what they were started with. Returns the
+    # number of feeds refreshed.
+    def refresh(self, session_code_id, gallery=None, roster=None):
+        with self._lock:
+            feeds = [feed for feed in self._feeds.values() if feed.session_code_id == str(session_code_id)]
+        for feed in feeds:
+            feed.pipeline.recognizer.refresh(gallery, roster)
+        return len(feeds)
+
+    def unsubscribe(self, feed):
+        with self._lock:
+            feed.subscribers -= 1
+            if feed.subscribers <= 0:
+                feed.subscribers = 0
+                feed.idle_since = time.monotonic()
+
+    # Multipart MJPEG stream of a camera for one viewer
+    def stream(self, feed, duration=None, **settings):
+        try:
+            yield from feed.pipeline.stream(duration, **settings)
+        finally:
+            self.unsubscribe(feed)
+
+    # Health and throughput of every configured camera
+    def stats(self):
+        with self._lock:
+            feeds = dict(self._feeds)
+        scheduling = self.scheduler.stats() if self.scheduler is not None else {}
+        stats = {}
+        for camera_id, config in self.cameras.items():
+            feed = feeds.get(camera_id)
+            stats[camera_id] = {
+                'name': config.get('name', f"Camera {camera_id}"),
+                'state': feed.pipeline.state if feed is not None else 'idle',
+            }
+            if feed is not None:
+                stats[camera_id].update({
+                    'session_code_id': feed.session_code_id,
+                    'subscribers': feed.subscribers,
+                    'pipeline': feed.pipeline.stats(),
+                    'scheduling': scheduling.get(camera_id),
+                })
+        return stats
+
+    # Stop one camera, or all of them
+    def stop_camera(self, camera_id=None):
+        with self._lock:
+            if camera_id is None:
+                feeds = list(self._feeds.values())
+                self._feeds.clear()
+            else:
+                feed = self._feeds.pop(camera_id, None)
+                feeds = [feed] if feed is not None else []
+        for feed in feeds:
+            self._close(feed)
+
+    def shutdown(self):
+        self._stop.set()
+        self.stop_camera()
+        if self.scheduler is not None:
+            self.scheduler.shutdown()
+
+    def _close(self, feed):
+        if self.scheduler is not None:
+            self.scheduler.unregister(feed.camera_id)
+        feed.pipeline.stop()
+        print(f"Camera {feed.camera_id} stopped: {feed.pipeline.stats()}")
+
+    def _start_reaper(self):
+        if self._reaper is None:
+            self._reaper = threading.Thread(target=self._reap, name='camera-reaper', daemon=True)
+            self._reaper.start()
+            # Release the capture devices when the process exits
+            atexit.register(self.shutdown)
+
+    def _reap(self):
+        interval = max(self.idle_timeout / 2, 0.5)
+        while not self._stop.wait(interval):
+            now = time.monotonic()
+            with self._lock:
+                idle = [
+                    camera_id for camera_id, feed in self._feeds.items()
+                    if feed.subscribers == 0 and now - feed.idle_since >= self.idle_timeout
+                ]
+                feeds = [self._feeds.pop(camera_id) for camera_id in idle]
+            for feed in feeds:
+                self._close(feed)
@@ -0,0 +1,172 @@
+import time
+
+import cv2
+import face_recognition
+
+from utils.tracking import iou_matrix
+
+DEFAULT_DETECTION_SCALE = 0.25
+DEFAULT_MIN_SCALE = 0.15
+DEFAULT_MAX_SCALE = 1.0
+# Smallest face, in detection image pixels, that HOG with one upsample finds reliably
+DEFAULT_MIN_FACE_PX = 40
+DEFAULT_FULL_SWEEP_EVERY = 10
+DEFAULT_ROI_MARGIN = 0.5
+DEFAULT_FACE_HISTORY = 30
+
+
+# Finds face boxes, in full frame (top, right, bottom, left) coordinates.
+#
+# In fixed mode every frame is downscaled by `scale`, as gen_frames used to.
+# In adaptive mode the scale follows the smallest face seen recently, so small
+# faces at the back of a room are still found while close-up kiosk cameras
+# use a cheap low resolution, and it is lowered whenever detection runs over
+# the frame-time budget. Detection can also be limited to regions of interest
+# (configured, or learned from where faces appeared), with a full-frame sweep
+# every `full_sweep_every` frames so new areas are not missed.
+class FaceDetector:
+    def __init__(self, scale=DEFAULT_DETECTION_SCALE, adaptive=False,
+                 min_scale=DEFAULT_MIN_SCALE, max_scale=DEFAULT_MAX_SCALE,
+                 min_face_px=DEFAULT_MIN_FACE_PX, frame_budget=None,
+                 rois=None, learn_roi=False, full_sweep_every=DEFAULT_FULL_SWEEP_EVERY,
+                 roi_margin=DEFAULT_ROI_MARGIN):
+        self.scale = scale
+        self.adaptive = adaptive
+        self.min_scale = min_scale
+        self.max_scale = max_scale
+        self.min_face_px = min_face_px
+        self.frame_budget = frame_budget
+        self.rois = [tuple(roi) for roi in rois or []]
+        self.learn_roi = learn_roi
+        self.full_sweep_every = full_sweep_every
+        self.roi_margin = roi_margin
+        self.frame_no = 0
+        self.full_sweeps = 0
+        self.last_seconds = 0.0
+        self.last_resize_seconds = 0.0
+        self._budget_scale = max_scale
+        self._face_sizes = []
+        self._learned_roi = None
+
+    @classmethod
+    def from_config(cls, config):
+        config = dict(config or {})
+        budget_ms = config.pop('frame_budget_ms', None)
+        mode = config.pop('mode', 'fixed')
+        return cls(adaptive=(mode == 'adaptive'),
+                   frame_budget=budget_ms / 1000.0 if budget_ms else None, **config)
+
+    def stats(self):
+        return {
+            'scale': self.scale,
+            'frames': self.frame_no,
+            'full_sweeps': self.full_sweeps,
+            'detect_seconds': self.last_seconds,
+            'learned_roi': self._learned_roi,
+        }
+
+    def detect(self, frame):
+        self.frame_no += 1
+        height, width = frame.shape[:2]
+        started = time.perf_counter()
+        self.last_resize_seconds = 0.0
+
+        regions = self._regions(width, height)
+        if regions is None:
+            self.full_sweeps += 1
+            regions = [(0, 0, width, height)]
+
+        boxes = []
+        for x, y, w, h in regions:
+            boxes.extend(self._detect_region(frame, x, y, w, h))
+        if len(regions) > 1:
+            boxes = _dedupe(boxes)
+
+        self.last_seconds = time.perf_counter() - started
+        self._observe(boxes, width, height)
+        return boxes
+
+    # Pixel regions to search this frame, or None for a full-frame sweep
+    def _regions(self, width, height):
+        if self.full_sweep_every and (self.frame_no - 1) % self.full_sweep_every == 0:
+            return None
+        rois = list(self.rois)
+        if self.learn_roi and self._learned_roi is not None:
+            rois.append(self._learned_roi)
+        if not rois:
+            return None
+        regions = []
+        for fx, fy, fw, fh in rois:
+            x, y = int(fx * width), int(fy * height)
+            w, h = int(fw * width), int(fh * height)
+            x, y = max(x, 0), max(y, 0)
+            w, h = min(w, width - x), min(h, height - y)
+            if w > 0 and h > 0:
+                regions.append((x, y, w, h))
+        return regions or None
+
+    def _detect_region(self, frame, x, y, w, h):
+        started = time.perf_counter()
+        crop = frame[y:y + h, x:x + w]
+        scale = self.scale
+        imgS = cv2.resize(crop, (0, 0), None, scale, scale) if scale != 1 else crop
+        imgS = cv2.cvtColor(imgS, cv2.COLOR_BGR2RGB)
+        self.last_resize_seconds += time.perf_counter() - started
+        return [
+            (int(round(top / scale)) + y, int(round(right / scale)) + x,
+             int(round(bottom / scale)) + y, int(round(left / scale)) + x)
+            for top, right, bottom, left in face_recognition.face_locations(imgS)
+        ]
+
+    # Update the scale and the learned region from this frame's results
+    def _observe(self, boxes, width, height):
+        if boxes:
+            self._face_sizes.extend(min(bottom - top, right - left) for top, right, bottom, left in boxes)
+            self._face_sizes = self._face_sizes[-DEFAULT_FACE_HISTORY:]
+            if self.learn_roi:
+                self._learn(boxes, width, height)
+
+        if not self.adaptive:
+            return
+
+        # Stay within the frame-time budget
+        if self.frame_budget:
+            if self.last_seconds > self.frame_budget:
+                self._budget_scale = max(self.min_scale, self.scale * 0.8)
+            elif self.last_seconds < self.frame_budget / 2:
+                self._budget_scale = min(self.max_scale, self._budget_scale * 1.1)
+
+        # Just large enough for the smallest recent face; empty scenes get
+        # whatever the budget allows so newcomers far away are still found
+        if self._face_sizes:
+            wanted = self.min_face_px / max(min(self._face_sizes), 1)
+        else:
+            wanted = self.max_scale
+        self.scale = max(self.min_scale, min(wanted, self._budget_scale, self.max_scale))
+
+    # Grow the learned region of interest to cover these faces plus a margin
+    def _learn(self, boxes, width, height):
+        for top, right, bottom, left in boxes:
+            margin_x = (right - left) * self.roi_margin
+            margin_y = (bottom - top) * self.roi_margin
+            x0 = max(left - margin_x, 0) / width
+            y0 = max(top - margin_y, 0) / height
+            x1 = min(right + margin_x, width) / width
+            y1 = min(bottom + margin_y, height) / height
+            if self._learned_roi is not None:
+                lx, ly, lw, lh = self._learned_roi
+                x0, y0 = min(x0, lx), min(y0, ly)
+                x1, y1 = max(x1, lx + lw), max(y1, ly + lh)
+            self._learned_roi = (x0, y0, x1 - x0, y1 - y0)
+
+
+# Drop boxes found twice where regions of interest overlap
+def _dedupe(boxes, threshold=0.5):
+    if len(boxes) < 2:
+        return boxes
+    overlap = iou_matrix(boxes, boxes)
+    kept = []
+    for i in range(len(boxes)):
+        if all(overlap[i, j] < threshold for j in kept):
+            kept.append(i)
+    return [boxes[i] for i in kept]
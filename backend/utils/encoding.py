@@ -0,0 +1,178 @@
+import hashlib
+import multiprocessing
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import face_recognition
+
+from utils.gallery import RESOURCES_FOLDER
+
+DEFAULT_CHUNKSIZE = 4
+
+
+# Path of the manifest that remembers what each uploaded image encoded to
+def manifest_file_path(session_code_id):
+    return os.path.join(RESOURCES_FOLDER, f"EncodeManifest_{session_code_id}.p")
+
+
+# Content hash of an uploaded image, read in chunks
+def file_hash(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Manifest maps filename -> {'hash': ..., 'encoding': ...}. Images
+# preprocessed at upload are recorded as {'hash': ..., 'location': ...}
+# until they are encoded.
+def load_manifest(path):
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'rb') as file:
+            return pickle.load(file)
+    except Exception as e:
+        print("Error reading manifest, rebuilding from scratch:", e)
+        return {}
+
+
+# Write to a temporary file first so readers never see a half written file
+def save_pickle_atomic(obj, path):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as file:
+        pickle.dump(obj, file)
+    os.replace(tmp_path, path)
+
+
+# Read and encode a single image file. Runs inside a pool worker, so errors are
+# returned instead of raised to keep one bad photo from aborting the batch.
+# With the face location known from upload time, detection is skipped.
+def encode_image_file(path, location=None):
+    try:
+        img = cv2.imread(path)
+        if img is None:
+            return path, None, "Could not read image"
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        encodings = face_recognition.face_encodings(img, [tuple(location)] if location else None)
+        if not encodings:
+            return path, None, "No face found"
+        return path, encodings[0], None
+    except Exception as e:
+        return path, None, str(e)
+
+
+# Start method of the encoding pools. The web server runs camera, inference
+# and writer threads, and a forked child can inherit one of their locks held
+# forever; workers start from a fresh interpreter instead (forkserver where
+# the platform has it, spawn elsewhere).
+def pool_context():
+    method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    return multiprocessing.get_context(method)
+
+
+# Encode image files across a process pool, yielding (path, encoding, error)
+# in input order. Only paths are sent to the workers, which load the images
+# themselves, so the batch is never held in memory at once. `encode` is the
+# per-file worker and must be picklable (a module level function or a
+# partial of one); `locations`, when given, is passed as its second argument.
+def encode_image_files(paths, workers=None, chunksize=DEFAULT_CHUNKSIZE, encode=encode_image_file,
+                       locations=None):
+    paths = list(paths)
+    args = [paths] if locations is None else [paths, list(locations)]
+    workers = workers or os.cpu_count() or 1
+    workers = min(workers, len(paths))
+    if workers <= 1:
+        yield from map(encode, *args)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=pool_context()) as executor:
+        yield from executor.map(encode, *args, chunksize=chunksize)
+
+
+# Add already computed encodings to a session's manifest, keyed by the
+# filename in the upload folder, so the next build reuses them
+def record_encodings(session_code_id, upload_folder, encodings):
+    folderPath = os.path.join(upload_folder, str(session_code_id))
+    manifest_path = manifest_file_path(session_code_id)
+    manifest = load_manifest(manifest_path)
+    for filename, encode in encodings.items():
+        manifest[filename] = {'hash': file_hash(os.path.join(folderPath, filename)), 'encoding': encode}
+    save_pickle_atomic(manifest, manifest_path)
+
+
+# Record where the faces of preprocessed uploads are ({filename: location}),
+# so the next build encodes them without running detection. Encodings of
+# files whose bytes did not change are kept.
+def record_face_locations(session_code_id, upload_folder, locations):
+    folderPath = os.path.join(upload_folder, str(session_code_id))
+    manifest_path = manifest_file_path(session_code_id)
+    manifest = load_manifest(manifest_path)
+    for filename, location in locations.items():
+        entry = {'hash': file_hash(os.path.join(folderPath, filename)), 'location': tuple(location)}
+        old = manifest.get(filename)
+        if old is not None and old['hash'] == entry['hash'] and old.get('encoding') is not None:
+            entry['encoding'] = old['encoding']
+        manifest[filename] = entry
+    save_pickle_atomic(manifest, manifest_path)
+
+
+# Rebuild a session's encodings, only encoding images that are new or changed.
+# Returns (encodings, student_ids, stats) where stats counts reused, computed
+# and removed images and lists (filename, reason) for images that failed.
+def build_encodings(session_code_id, upload_folder, workers=None, chunksize=DEFAULT_CHUNKSIZE):
+    folderPath = os.path.join(upload_folder, str(session_code_id))
+    manifest_path = manifest_file_path(session_code_id)
+    old_manifest = load_manifest(manifest_path)
+
+    # Dotfiles are temporary files, never enrollment photos
+    pathList = sorted(
+        f for f in os.listdir(folderPath)
+        if not f.startswith('.') and os.path.isfile(os.path.join(folderPath, f))
+    ) if os.path.isdir(folderPath) else []
+
+    manifest = {}
+    changed = []
+    for path in pathList:
+        digest = file_hash(os.path.join(folderPath, path))
+        entry = old_manifest.get(path)
+        if entry is not None and entry['hash'] == digest and entry.get('encoding') is not None:
+            manifest[path] = entry
+        else:
+            # A face location recorded at upload is only valid for the same bytes
+            location = entry.get('location') if entry is not None and entry['hash'] == digest else None
+            changed.append((path, digest, location))
+
+    failed = []
+    # Encoded from the face location found at upload, without detection
+    known_location = 0
+    results = encode_image_files(
+        [os.path.join(folderPath, path) for path, _, _ in changed], workers, chunksize,
+        locations=[location for _, _, location in changed])
+    for (path, digest, location), (_, encode, error) in zip(changed, results):
+        if error is None:
+            manifest[path] = {'hash': digest, 'encoding': encode}
+            if location is not None:
+                manifest[path]['location'] = location
+                known_location += 1
+        else:
+            # Failed images stay out of the manifest so they are retried next time
+            failed.append((path, error))
+
+    stats = {
+        'reused': len(pathList) - len(changed),
+        'computed': len(changed) - len(failed),
+        'removed': len(set(old_manifest) - set(pathList)),
+        'known_location': known_location,
+        'failed': failed,
+    }
+
+    save_pickle_atomic(manifest, manifest_path)
+
+    encoded = [path for path in pathList if path in manifest]
+    encodeListKnown = [manifest[path]['encoding'] for path in encoded]
+    studentIds = [os.path.splitext(path)[0] for path in encoded]
+    return encodeListKnown, studentIds, stats
@@ -0,0 +1,191 @@
+import csv
+import functools
+import io
+import os
+import shutil
+import zipfile
+
+import face_recognition
+from sqlalchemy import insert, or_, select
+from werkzeug.utils import secure_filename
+
+from utils.encoding import DEFAULT_CHUNKSIZE, encode_image_files
+from utils.preprocess import chip_path, preprocess_photo
+
+ROSTER_FIELDS = ('name', 'rollno', 'division', 'branch', 'regid')
+# Header spellings accepted for the roster columns (the add_user form names)
+HEADER_ALIASES = {'roll_no': 'rollno', 'reg_id': 'regid', 'registration_id': 'regid', 'roll_number': 'rollno'}
+PHOTO_EXTENSIONS = {'png', 'jpg', 'jpeg'}
+# Larger archive members are skipped rather than extracted
+MAX_PHOTO_BYTES = 20 * 1024 * 1024
+CHIP_STAGING = '.chips'
+
+
+# Roster rows of an uploaded CSV. Returns (rows, errors) where errors lists
+# (line, reason) for rows that are incomplete, have a registration id that
+# is not a plain file name, or repeat a name, roll number or registration id
+# of an earlier row.
+def read_roster_csv(stream):
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    reader = csv.DictReader(text)
+    if reader.fieldnames is None:
+        return [], [(1, 'Empty CSV file')]
+    header = {}
+    for column in reader.fieldnames:
+        key = (column or '').strip().lower().replace(' ', '_')
+        header[column] = HEADER_ALIASES.get(key, key)
+    missing = set(ROSTER_FIELDS) - set(header.values())
+    if missing:
+        return [], [(1, 'Missing columns: ' + ', '.join(sorted(missing)))]
+
+    rows, errors = [], []
+    seen = {field: set() for field in ('name', 'rollno', 'regid')}
+    for line, record in enumerate(reader, start=2):
+        row = {header[column]: (value or '').strip() for column, value in record.items()
+               if column in header and header[column] in ROSTER_FIELDS}
+        empty = [field for field in ROSTER_FIELDS if not row.get(field)]
+        if empty:
+            errors.append((line, 'Missing ' + ', '.join(empty)))
+            continue
+        # The regid names the photo on disk, so it must survive secure_filename
+        # unchanged or the stored photo would not match the student
+        if secure_filename(row['regid']) != row['regid']:
+            errors.append((line, 'Registration id must contain only letters, digits, dots, dashes or underscores'))
+            continue
+        repeated = [field for field in seen if row[field] in seen[field]]
+        if repeated:
+            errors.append((line, 'Repeats an earlier ' + ', '.join(repeated)))
+            continue
+        for field in seen:
+            seen[field].add(row[field])
+        rows.append(row)
+    return rows, errors
+
+
+# Split rows into (new, duplicates) with one query for every name, roll
+# number and registration id that is already enrolled (they are unique
+# across all sessions)
+def split_duplicates(db, Student_data, rows):
+    if not rows:
+        return [], []
+    names = {row['name'] for row in rows}
+    rollnos = {row['rollno'] for row in rows}
+    regids = {row['regid'] for row in rows}
+    taken = db.session.execute(
+        select(Student_data.name, Student_data.rollno, Student_data.regid).where(or_(
+            Student_data.name.in_(names), Student_data.rollno.in_(rollnos), Student_data.regid.in_(regids)))
+    ).all()
+    taken_names = {name for name, _, _ in taken}
+    taken_rollnos = {rollno for _, rollno, _ in taken}
+    taken_regids = {regid for _, _, regid in taken}
+
+    new, duplicates = [], []
+    for row in rows:
+        if row['name'] in taken_names or row['rollno'] in taken_rollnos or row['regid'] in taken_regids:
+            duplicates.append(row)
+        else:
+            new.append(row)
+    return new, duplicates
+
+
+# Extract the photos of the wanted registration ids from a zip archive into
+# folder, named <regid>.<ext> whatever their path inside the archive.
+# Returns ({regid: path}, errors) where errors lists (member, reason).
+def extract_photos(archive, regids, folder):
+    photos, errors = {}, []
+    with zipfile.ZipFile(archive) as zf:
+        for member in zf.infolist():
+            if member.is_dir():
+                continue
+            filename = os.path.basename(member.filename)
+            stem, _, extension = filename.rpartition('.')
+            extension = extension.lower()
+            if not stem or filename.startswith('.') or '__MACOSX' in member.filename:
+                continue
+            if stem not in regids:
+                errors.append((member.filename, 'No roster row with this registration id'))
+                continue
+            if extension not in PHOTO_EXTENSIONS:
+                errors.append((member.filename, 'Unsupported file type'))
+                continue
+            if member.file_size > MAX_PHOTO_BYTES:
+                errors.append((member.filename, 'File too large'))
+                continue
+            if stem in photos:
+                errors.append((member.filename, 'More than one photo for this registration id'))
+                continue
+            # Only the regid decides the name on disk, never the archive path
+            path = os.path.join(folder, secure_filename(f"{stem}.{extension}"))
+            with zf.open(member) as source, open(path, 'wb') as target:
+                shutil.copyfileobj(source, target)
+            photos[stem] = path
+    return photos, errors
+
+
+# Preprocess a photo (downsize, exactly one face, aligned chip saved into
+# chip_folder) and encode it at the location found. Runs inside a pool
+# worker; returns (path, encoding, error) like encode_image_file.
+def check_photo(path, chip_folder=None, **settings):
+    try:
+        chip_file = os.path.join(chip_folder, os.path.basename(path) + '.png') if chip_folder else None
+        img, location = preprocess_photo(path, chip_file, **settings)
+        return path, face_recognition.face_encodings(img, [location])[0], None
+    except Exception as e:
+        return path, None, str(e)
+
+
+# Enroll a roster with its photos: rows already enrolled or without a valid
+# one-face photo are rejected, the rest are inserted in a single statement
+# and their photos moved into the session upload folder. The encodings
+# computed while validating are returned as {filename: encoding} so the
+# gallery never encodes these photos again. `preprocess` holds the
+# preprocess_photo settings (the "enrollment" config block).
+# Returns (enrolled rows, encodings, rejected [(regid or line, reason)]).
+def enroll_students(db, Student_data, session_code_id, rows, photos, upload_folder,
+                    workers=None, chunksize=DEFAULT_CHUNKSIZE, preprocess=None):
+    rejected = []
+    rows, duplicates = split_duplicates(db, Student_data, rows)
+    rejected += [(row['regid'], 'Already enrolled') for row in duplicates]
+
+    with_photo = []
+    for row in rows:
+        if row['regid'] in photos:
+            with_photo.append(row)
+        else:
+            rejected.append((row['regid'], 'No photo in the archive'))
+
+    checked = {}
+    paths = [photos[row['regid']] for row in with_photo]
+    # Chips are cut next to the staged photos and moved with them
+    staging_chips = os.path.join(os.path.dirname(paths[0]), CHIP_STAGING) if paths else None
+    check = functools.partial(check_photo, chip_folder=staging_chips, **(preprocess or {}))
+    for path, encode, error in encode_image_files(paths, workers, chunksize, encode=check):
+        checked[path] = (encode, error)
+
+    enrolled = []
+    for row in with_photo:
+        encode, error = checked[photos[row['regid']]]
+        if error is None:
+            enrolled.append(row)
+        else:
+            rejected.append((row['regid'], error))
+    if not enrolled:
+        return [], {}, rejected
+
+    db.session.execute(insert(Student_data), [dict(row, session_code_id=session_code_id) for row in enrolled])
+    db.session.commit()
+
+    session_folder = os.path.join(upload_folder, str(session_code_id))
+    os.makedirs(session_folder, exist_ok=True)
+    encodings = {}
+    for row in enrolled:
+        path = photos[row['regid']]
+        filename = os.path.basename(path)
+        shutil.move(path, os.path.join(session_folder, filename))
+        staged_chip = os.path.join(staging_chips, filename + '.png')
+        if os.path.exists(staged_chip):
+            final_chip = chip_path(upload_folder, session_code_id, filename)
+            os.makedirs(os.path.dirname(final_chip), exist_ok=True)
+            shutil.move(staged_chip, final_chip)
+        encodings[filename] = checked[path][0]
+    return enrolled, encodings, rejected
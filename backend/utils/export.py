@@ -0,0 +1,75 @@
+import csv
+import io
+
+from sqlalchemy import select
+
+DEFAULT_EXPORT_CHUNK = 2000
+
+EXPORT_HEADER = ['Name', 'Start Time', 'End Time', 'Date',
+                 'Roll Number', 'Division', 'Branch', 'Registration ID']
+PARQUET_COLUMNS = ['name', 'start_time', 'end_time', 'date', 'roll_no', 'division', 'branch', 'reg_id']
+
+
+# Attendance of a session between two dates (inclusive), optionally for one
+# branch and/or division, in the order of the (session, date, reg_id) index
+def attendance_export_query(Attendance, session_code_id, start_date, end_date, branch=None, division=None):
+    query = select(
+        Attendance.name, Attendance.start_time, Attendance.end_time, Attendance.date,
+        Attendance.roll_no, Attendance.division, Attendance.branch, Attendance.reg_id,
+    ).where(
+        Attendance.session_code_id == session_code_id,
+        Attendance.date >= start_date,
+        Attendance.date <= end_date,
+    )
+    if branch:
+        query = query.where(Attendance.branch == branch)
+    if division:
+        query = query.where(Attendance.division == division)
+    return query.order_by(Attendance.date, Attendance.reg_id)
+
+
+# Rows of a query fetched from a server-side cursor chunk_size at a time, so
+# the result set is never held in memory as a whole
+def iter_rows(db, query, chunk_size=DEFAULT_EXPORT_CHUNK):
+    result = db.session.execute(query.execution_options(stream_results=True, yield_per=chunk_size))
+    try:
+        for partition in result.partitions():
+            yield partition
+    finally:
+        result.close()
+
+
+# CSV text of the rows, one chunk of lines at a time
+def csv_chunks(partitions):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_HEADER)
+    for rows in partitions:
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+# Write the rows to a Parquet file one row group per chunk. Needs pyarrow
+# (pandas' Parquet engine); raises ImportError when it is not installed.
+# Returns the number of rows written.
+def write_parquet(partitions, file):
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([
+        ('name', pa.string()), ('start_time', pa.string()), ('end_time', pa.string()),
+        ('date', pa.date32()), ('roll_no', pa.string()), ('division', pa.string()),
+        ('branch', pa.string()), ('reg_id', pa.string()),
+    ])
+    count = 0
+    with pq.ParquetWriter(file, schema) as writer:
+        for rows in partitions:
+            frame = pd.DataFrame.from_records(rows, columns=PARQUET_COLUMNS)
+            writer.write_table(pa.Table.from_pandas(frame, schema=schema, preserve_index=False))
+            count += len(rows)
+    return count
@@ -0,0 +1,246 @@
+import glob
+import json
+import os
+import pickle
+import struct
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# face_recognition produces 128-d embeddings and treats distances <= 0.6 as a match
+ENCODING_DIM = 128
+DEFAULT_TOLERANCE = 0.6
+
+RESOURCES_FOLDER = 'Resources'
+DEFAULT_CACHE_BYTES = 256 * 1024 * 1024
+
+# Binary gallery file layout (little endian):
+#   header   magic, version, dim, count, then offsets of the blocks below
+#   block 1  count x dim float32 encodings, 64-byte aligned
+#   block 2  count float32 squared norms
+#   block 3  UTF-8 JSON list of student ids
+GALLERY_MAGIC = b'FAGALLRY'
+GALLERY_VERSION = 1
+GALLERY_HEADER = struct.Struct('<8sIIQQQQQ')
+GALLERY_ALIGN = 64
+
+
+# Encodings of one session held as a single contiguous float32 matrix
+class GalleryIndex:
+    def __init__(self, encodings, student_ids, norms=None):
+        matrix = np.asarray(encodings, dtype=np.float32).reshape(-1, ENCODING_DIM)
+        self.matrix = np.ascontiguousarray(matrix)
+        # Squared norms are precomputed so a lookup is a single matrix product
+        if norms is None:
+            norms = np.einsum('ij,ij->i', self.matrix, self.matrix)
+        self.norms = norms
+        self.student_ids = list(student_ids)
+        if len(self.student_ids) != len(self.matrix):
+            raise ValueError("Number of student ids does not match number of encodings")
+
+    def __len__(self):
+        return len(self.student_ids)
+
+    @property
+    def nbytes(self):
+        return self.matrix.nbytes + self.norms.nbytes
+
+    # Euclidean distance of every face in the frame to every known encoding
+    def distances(self, face_encodings):
+        faces = np.asarray(face_encodings, dtype=np.float32).reshape(-1, ENCODING_DIM)
+        face_norms = np.einsum('ij,ij->i', faces, faces)
+        squared = face_norms[:, None] + self.norms[None, :] - 2.0 * (faces @ self.matrix.T)
+        np.maximum(squared, 0.0, out=squared)
+        return np.sqrt(squared)
+
+    # Top-k (student_id, distance) pairs within tolerance for each face, closest first
+    def match(self, face_encodings, tolerance=DEFAULT_TOLERANCE, k=1):
+        if len(face_encodings) == 0:
+            return []
+        if len(self) == 0:
+            return [[] for _ in range(len(face_encodings))]
+
+        dist = self.distances(face_encodings)
+        k = min(k, dist.shape[1])
+        if k < dist.shape[1]:
+            candidates = np.argpartition(dist, k - 1, axis=1)[:, :k]
+        else:
+            candidates = np.tile(np.arange(dist.shape[1]), (dist.shape[0], 1))
+        candidate_dist = np.take_along_axis(dist, candidates, axis=1)
+        order = np.argsort(candidate_dist, axis=1)
+        candidates = np.take_along_axis(candidates, order, axis=1)
+        candidate_dist = np.take_along_axis(candidate_dist, order, axis=1)
+
+        results = []
+        for row_idx, row_dist in zip(candidates, candidate_dist):
+            results.append([
+                (self.student_ids[i], float(d))
+                for i, d in zip(row_idx, row_dist) if d <= tolerance
+            ])
+        return results
+
+    # Closest student id for each face, or None when nothing is within tolerance
+    def best_matches(self, face_encodings, tolerance=DEFAULT_TOLERANCE):
+        return [found[0][0] if found else None
+                for found in self.match(face_encodings, tolerance, k=1)]
+
+
+# Path of the encoding file generated for a session
+def encoding_file_path(session_code_id):
+    return os.path.join(RESOURCES_FOLDER, f"EncodeFile_{session_code_id}.gal")
+
+
+def _align(offset):
+    return (offset + GALLERY_ALIGN - 1) // GALLERY_ALIGN * GALLERY_ALIGN
+
+
+# Write a gallery in the binary format. The file is written next to the target
+# and renamed over it, so readers (and other workers' memmaps) never see a
+# partially written gallery.
+def save_gallery(path, encodings, student_ids):
+    matrix = np.ascontiguousarray(
+        np.asarray(encodings, dtype='<f4').reshape(-1, ENCODING_DIM))
+    student_ids = [str(student_id) for student_id in student_ids]
+    if len(student_ids) != len(matrix):
+        raise ValueError("Number of student ids does not match number of encodings")
+    norms = np.einsum('ij,ij->i', matrix, matrix).astype('<f4')
+    ids_blob = json.dumps(student_ids).encode('utf-8')
+
+    data_offset = _align(GALLERY_HEADER.size)
+    norms_offset = data_offset + matrix.nbytes
+    ids_offset = norms_offset + norms.nbytes
+    header = GALLERY_HEADER.pack(GALLERY_MAGIC, GALLERY_VERSION, ENCODING_DIM, len(matrix),
+                                 data_offset, norms_offset, ids_offset, len(ids_blob))
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as file:
+        file.write(header)
+        file.write(b'\0' * (data_offset - GALLERY_HEADER.size))
+        file.write(matrix.tobytes())
+        file.write(norms.tobytes())
+        file.write(ids_blob)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
+
+
+# Load a binary gallery without copying the encodings. The matrix is a
+# read-only memmap, so worker processes share the pages via the OS page cache.
+def load_gallery(path):
+    with open(path, 'rb') as file:
+        header = file.read(GALLERY_HEADER.size)
+        if len(header) != GALLERY_HEADER.size:
+            raise ValueError(f"Truncated gallery file: {path}")
+        (magic, version, dim, count, data_offset,
+         norms_offset, ids_offset, ids_length) = GALLERY_HEADER.unpack(header)
+        if magic != GALLERY_MAGIC:
+            raise ValueError(f"Not a gallery file: {path}")
+        if version != GALLERY_VERSION:
+            raise ValueError(f"Unsupported gallery version {version}: {path}")
+        if dim != ENCODING_DIM:
+            raise ValueError(f"Unexpected encoding size {dim}: {path}")
+        file.seek(ids_offset)
+        student_ids = json.loads(file.read(ids_length).decode('utf-8'))
+
+    if count == 0:
+        return GalleryIndex(np.empty((0, ENCODING_DIM), dtype=np.float32), student_ids)
+    matrix = np.memmap(path, dtype='<f4', mode='r', offset=data_offset, shape=(count, dim))
+    norms = np.memmap(path, dtype='<f4', mode='r', offset=norms_offset, shape=(count,))
+    return GalleryIndex(matrix, student_ids, norms=norms)
+
+
+# Load a legacy pickled [encodings, student_ids] file into an index
+def load_pickle_gallery(path):
+    with open(path, 'rb') as file:
+        encodeListKnown, studentIds = pickle.load(file)
+    return GalleryIndex(encodeListKnown, studentIds)
+
+
+# One-time conversion of pickled EncodeFile*.p galleries to the binary format.
+# Returns the list of files written; existing binary galleries are kept.
+def convert_pickle_galleries(folder=RESOURCES_FOLDER, overwrite=False):
+    converted = []
+    for pickle_path in sorted(glob.glob(os.path.join(folder, 'EncodeFile*.p'))):
+        gallery_path = os.path.splitext(pickle_path)[0] + '.gal'
+        if os.path.exists(gallery_path) and not overwrite:
+            continue
+        index = load_pickle_gallery(pickle_path)
+        save_gallery(gallery_path, index.matrix, index.student_ids)
+        converted.append(gallery_path)
+    return converted
+
+
+# Process-wide LRU cache of loaded galleries keyed by session id.
+# Entries are reloaded when the file mtime changes and evicted least recently
+# used first once the resident galleries exceed max_bytes.
+class GalleryCache:
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES, loader=load_gallery, path_for=encoding_file_path):
+        self.max_bytes = max_bytes
+        self.loader = loader
+        self.path_for = path_for
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # session id -> (file signature, index)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    # Return the gallery for a session, or None when no encoding file exists
+    def get(self, session_code_id):
+        key = str(session_code_id)
+        path = self.path_for(key)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            self.invalidate(key)
+            return None
+        signature = (stat.st_mtime_ns, stat.st_size)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == signature:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        # Load outside the lock so a slow file does not block other sessions
+        index = self.loader(path)
+        with self._lock:
+            self._drop(key)
+            if index.nbytes <= self.max_bytes:
+                self._entries[key] = (signature, index)
+                self.current_bytes += index.nbytes
+                self._evict()
+        return index
+
+    # Drop a session, e.g. after its encodings were regenerated
+    def invalidate(self, session_code_id):
+        with self._lock:
+            self._drop(str(session_code_id))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def set_budget(self, max_bytes):
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.current_bytes -= entry[1].nbytes
+
+    def _evict(self):
+        while self.current_bytes > self.max_bytes and self._entries:
+            _, (_, index) = self._entries.popitem(last=False)
+            self.current_bytes -= index.nbytes
+
+
+gallery_cache = GalleryCache()
@@ -4,6 +4,10 @@ import numpy as np
 from datetime import datetime
 import time
 from flask_bcrypt import Bcrypt
+from utils.attendance import upsert_attendance
+from utils.gallery import DEFAULT_TOLERANCE
+from utils.metrics import attendance_rows_total, attendance_write_errors, attendance_write_seconds
+from utils.roster import roster_cache, EMPTY_ROSTER_ENTRY
 
 bcrypt = Bcrypt()
 
@@ -13,12 +17,6 @@ def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
-# Function to stop the camera
-def stop_camera():
-    from app import camera
-    if camera is not None:
-        camera.release()
-
 # Encode known student images
 def findEncodings(imageslist):
     encodeList = []
@@ -29,9 +27,10 @@ def findEncodings(imageslist):
     return encodeList
 
 # Compare incoming face with known encodings
-def compare(encodeListKnown, encodeFace):
-    matches = face_recognition.compare_faces(encodeListKnown, encodeFace)
+def compare(encodeListKnown, encodeFace, tolerance=DEFAULT_TOLERANCE):
+    # Distances are computed once and the matches derived from them
     faceDis = face_recognition.face_distance(encodeListKnown, encodeFace)
+    matches = list(faceDis <= tolerance)
     matchIndex = np.argmin(faceDis)
     return matches, faceDis, matchIndex
 
@@ -42,63 +41,40 @@ def get_data(matches, matchIndex, studentIds):
         return student_id
     return None
 
-# Get student info from the database by ID
+# Get student info by ID from the cached session roster
 def mysqlconnect(student_id, session_code_id):
-    from app import Student_data, app
-
     if student_id is None:
-        return None, None, None, None, None
+        return EMPTY_ROSTER_ENTRY
 
     try:
-        with app.app_context():
-            student_data = Student_data.query.filter_by(regid=student_id, session_code_id=session_code_id).first()
-            if student_data:
-                return (
-                    student_data.id,
-                    student_data.name,
-                    student_data.rollno,
-                    student_data.division,
-                    student_data.branch
-                )
-            else:
-                return None, None, None, None, None
+        return roster_cache.lookup(session_code_id, student_id)
     except Exception as e:
         print("Error:", e)
-        return None, None, None, None, None
+        return EMPTY_ROSTER_ENTRY
 
 # Record or update attendance entry
 def record_attendance(name, current_date, roll_no, div, branch, reg_id, session_code_id):
     from app import db, Attendance, app
 
+    started = time.perf_counter()
     try:
         with app.app_context():
-            existing_entry = Attendance.query.filter_by(
-                reg_id=reg_id,
-                date=current_date,
-                session_code_id=session_code_id
-            ).first()
-
+            # Insert, or move end_time forward, in one statement on the
+            # (session_code_id, reg_id, date) key; no check-then-write race
             current_time_str = datetime.now().strftime("%H:%M:%S")
-
-            if existing_entry:
-                existing_entry.end_time = current_time_str
-                db.session.commit()
-                print("End time updated")
-            else:
-                new_attendance = Attendance(
-                    name=name,
-                    start_time=current_time_str,
-                    end_time=current_time_str,
-                    date=current_date,
-                    roll_no=roll_no,
-                    division=div,
-                    branch=branch,
-                    reg_id=reg_id,
-                    session_code_id=session_code_id
-                )
-                db.session.add(new_attendance)
-                db.session.commit()
-                print(f"Recorded for {reg_id} in session {session_code_id}")
-                print("Start and end time recorded (first entry)")
+            upsert_attendance(db, Attendance, [{
+                'name': name,
+                'start_time': current_time_str,
+                'end_time': current_time_str,
+                'date': current_date,
+                'roll_no': roll_no,
+                'division': div,
+                'branch': branch,
+                'reg_id': reg_id,
+                'session_code_id': session_code_id,
+            }])
+        attendance_rows_total.labels('single').inc()
     except Exception as e:
+        attendance_write_errors.labels('single').inc()
         print("Error:", e)
+    attendance_write_seconds.labels('single').observe(time.perf_counter() - started)
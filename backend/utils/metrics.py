@@ -0,0 +1,207 @@
+import bisect
+import threading
+
+# Stage latencies range from sub-millisecond dictionary lookups to HOG
+# detection on a full frame, so buckets span 0.5 ms to 5 s
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# One labelled series of a histogram. Observing takes a short lock and a
+# bisect, cheap enough for every stage of every frame.
+class _HistogramChild:
+    def __init__(self, buckets):
+        self._buckets = buckets
+        self._counts = [0] * (len(buckets) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self._buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    def snapshot(self):
+        with self._lock:
+            return list(self._counts), self._sum
+
+
+class _CounterChild:
+    def __init__(self):
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self):
+        return self._value
+
+
+# Base of a metric family; children are created once per label combination
+# and should be kept by the caller so the hot path skips the lookup
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        key = tuple(str(value) for value in values)
+        if len(key) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}")
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            children = list(self._children.items())
+        for values, child in children:
+            lines.extend(self._render_child(values, child))
+        return lines
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def _render_child(self, values, child):
+        counts, total = child.snapshot()
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            le = f'le="{_number(bound)}"'
+            yield f"{self.name}_bucket{_labels(self.labelnames, values, le)} {cumulative}"
+        yield f"{self.name}_sum{_labels(self.labelnames, values)} {_number(total)}"
+        yield f"{self.name}_count{_labels(self.labelnames, values)} {cumulative}"
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def _render_child(self, values, child):
+        yield f"{self.name}{_labels(self.labelnames, values)} {_number(child.value)}"
+
+
+# Gauge read at scrape time from a callback returning [(labelvalues, value)]
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def __init__(self, name, help, labelnames=(), collect=None):
+        super().__init__(name, help, labelnames)
+        self.collect = collect
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        try:
+            samples = list(self.collect()) if self.collect else []
+        except Exception as e:
+            print("Error collecting metric:", self.name, e)
+            samples = []
+        for values, value in samples:
+            if value is not None:
+                lines.append(f"{self.name}{_labels(self.labelnames, values)} {_number(value)}")
+        return lines
+
+
+# Metrics of the app, rendered in the Prometheus text exposition format
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _add(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, help, labelnames, buckets))
+
+    def counter(self, name, help, labelnames=()):
+        return self._add(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=(), collect=None):
+        return self._add(Gauge(name, help, labelnames, collect))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+stage_seconds = registry.histogram(
+    'face_attendance_stage_seconds', "Time spent in each recognition pipeline stage",
+    ('camera', 'session', 'stage'))
+faces_total = registry.counter(
+    'face_attendance_faces_total', "Faces seen in processed frames, by outcome",
+    ('camera', 'session', 'result'))
+attendance_write_seconds = registry.histogram(
+    'face_attendance_attendance_write_seconds', "Latency of attendance database writes",
+    ('mode',))
+attendance_write_errors = registry.counter(
+    'face_attendance_attendance_write_errors_total', "Attendance writes that failed",
+    ('mode',))
+attendance_rows_total = registry.counter(
+    'face_attendance_attendance_rows_total', "Attendance rows written", ('mode',))
+
+
+# Stage timers of one camera and session, with the label lookups done once
+class StageMetrics:
+    STAGES = ('capture', 'motion', 'resize', 'face_locations', 'track', 'cvtcolor',
+              'face_encodings', 'match', 'roster', 'annotate', 'imencode')
+
+    def __init__(self, camera_id, session_code_id):
+        camera, session = str(camera_id), str(session_code_id)
+        self._stages = {stage: stage_seconds.labels(camera, session, stage) for stage in self.STAGES}
+        self.detected = faces_total.labels(camera, session, 'detected')
+        self.matched = faces_total.labels(camera, session, 'matched')
+        self.unknown = faces_total.labels(camera, session, 'unknown')
+
+    def observe(self, stage, seconds):
+        self._stages[stage].observe(seconds)
+
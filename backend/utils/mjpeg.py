@@ -0,0 +1,159 @@
+import threading
+import time
+from collections import OrderedDict
+
+import cv2
+
+from utils.motion import MotionGate
+from utils.recognition import annotate
+
+DEFAULT_STREAM_FPS = 10
+DEFAULT_JPEG_QUALITY = 75
+DEFAULT_STREAM_WIDTH = 640
+MAX_STREAM_FPS = 30
+# Viewer settings are snapped to these so clients cannot ask for an encode per
+# arbitrary value: quality in steps of 5, widths from a fixed set (0 = full frame)
+MIN_JPEG_QUALITY = 30
+MAX_JPEG_QUALITY = 95
+JPEG_QUALITY_STEP = 5
+STREAM_WIDTHS = (160, 320, 480, 640, 960, 1280)
+# Encoded variants kept per camera, least recently used dropped first
+MAX_ENCODED_VARIANTS = 8
+
+# Anything below this is sensor noise, not a visible change
+_UNCHANGED_THRESHOLD = 0.001
+_UNCHANGED_PIXEL_DELTA = 8
+_UNCHANGED_REFRESH_EVERY = 100
+
+
+# One encoded JPEG for one (quality, width) setting
+class _EncodedFrame:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+        self.jpeg = None
+        self.gate = MotionGate(threshold=_UNCHANGED_THRESHOLD, pixel_delta=_UNCHANGED_PIXEL_DELTA,
+                               refresh_every=_UNCHANGED_REFRESH_EVERY)
+
+
+def normalize_quality(quality):
+    quality = min(max(int(quality), MIN_JPEG_QUALITY), MAX_JPEG_QUALITY)
+    return int(round(quality / JPEG_QUALITY_STEP)) * JPEG_QUALITY_STEP
+
+
+# Largest allowed width not above the requested one (0 keeps the full frame)
+def normalize_width(width):
+    if not width or width <= 0:
+        return 0
+    allowed = [w for w in STREAM_WIDTHS if w <= width]
+    return allowed[-1] if allowed else STREAM_WIDTHS[0]
+
+
+# Demand-driven MJPEG output of a pipeline. Frames are only annotated and
+# encoded when a viewer asks for one, once per new frame and per
+# (quality, width) setting, so viewers with the same settings share one
+# encode. If the annotated frame did not visibly change, the previous buffer
+# is reused and not sent again.
+class MjpegOutput:
+    def __init__(self, pipeline, fps=DEFAULT_STREAM_FPS, quality=DEFAULT_JPEG_QUALITY, width=DEFAULT_STREAM_WIDTH):
+        self.pipeline = pipeline
+        self.fps = fps
+        self.quality = quality
+        self.width = width
+        self.encodes = 0
+        self.reused = 0
+        self.shared = 0
+        self.bytes_sent = 0
+        self.encode_seconds = 0.0
+        self._encoded = OrderedDict()
+        self._lock = threading.Lock()
+
+    def stats(self):
+        return {
+            'encodes': self.encodes,
+            'reused': self.reused,
+            'shared': self.shared,
+            'bytes_sent': self.bytes_sent,
+            'avg_encode_seconds': self.encode_seconds / self.encodes if self.encodes else 0.0,
+        }
+
+    # JPEG of the newest frame with the newest annotations at these settings
+    def jpeg(self, quality, width):
+        frame_seq, frame = self.pipeline.frames.peek()
+        if frame is None:
+            return None
+        quality = normalize_quality(quality)
+        width = normalize_width(width)
+        if width >= frame.shape[1]:
+            width = 0
+        key = (quality, width)
+        with self._lock:
+            encoded = self._encoded.get(key)
+            if encoded is None:
+                encoded = self._encoded[key] = _EncodedFrame()
+                # A viewer still holding a dropped variant just encodes once more
+                while len(self._encoded) > MAX_ENCODED_VARIANTS:
+                    self._encoded.popitem(last=False)
+            else:
+                self._encoded.move_to_end(key)
+
+        with encoded.lock:
+            frame_seq, frame = self.pipeline.frames.peek()
+            results_seq, results = self.pipeline.results.peek()
+            version = (frame_seq, results_seq)
+            if encoded.version == version:
+                self.shared += 1
+                return encoded.jpeg
+
+            started = time.perf_counter()
+            height, frame_width = frame.shape[:2]
+            scale = width / frame_width if width and width < frame_width else 1.0
+            if scale != 1.0:
+                image = cv2.resize(frame, (width, int(height * scale)), interpolation=cv2.INTER_AREA)
+                results = [r._replace(box=tuple(int(v * scale) for v in r.box)) for r in results or []]
+            else:
+                image = frame.copy()
+            metrics = self.pipeline.recognizer.metrics
+            annotating = time.perf_counter()
+            image = annotate(image, results or [])
+            metrics.observe('annotate', time.perf_counter() - annotating)
+
+            encoded.version = version
+            if encoded.jpeg is not None and not encoded.gate.should_process(image):
+                self.reused += 1
+                return encoded.jpeg
+            encoding = time.perf_counter()
+            ret, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+            metrics.observe('imencode', time.perf_counter() - encoding)
+            if ret:
+                encoded.jpeg = buffer.tobytes()
+                self.encodes += 1
+                self.encode_seconds += time.perf_counter() - started
+            return encoded.jpeg
+
+    # Multipart MJPEG chunks for one viewer, at most `fps` frames a second
+    def stream(self, duration=None, fps=None, quality=None, width=None):
+        fps = min(fps or self.fps, MAX_STREAM_FPS)
+        quality = quality or self.quality
+        width = self.width if width is None else width
+        interval = 1.0 / fps
+        seq = 0
+        last_sent = None
+        start_time = time.time()
+        while duration is None or time.time() - start_time < duration:
+            seq, frame = self.pipeline.frames.get(seq, self.pipeline.poll_timeout)
+            if frame is None:
+                if not self.pipeline.running:
+                    break
+                continue
+            started = time.monotonic()
+            jpeg = self.jpeg(quality, width)
+            if jpeg is not None and jpeg is not last_sent:
+                last_sent = jpeg
+                self.bytes_sent += len(jpeg)
+                yield (b'--frame\r\n'
+                       b'Content-Type: image/jpeg\r\n\r\n' + jpeg + b'\r\n')
+            # Per-viewer frame-rate cap
+            remaining = interval - (time.monotonic() - started)
+            if remaining > 0:
+                time.sleep(remaining)
@@ -0,0 +1,75 @@
+import cv2
+import numpy as np
+
+DEFAULT_MOTION_WIDTH = 160
+DEFAULT_PIXEL_DELTA = 25
+DEFAULT_MOTION_THRESHOLD = 0.005
+DEFAULT_REFRESH_EVERY = 50
+
+
+# Cheap change detector placed in front of face detection. Each frame is
+# shrunk to a small blurred grayscale image and compared with the frame that
+# was last sent to recognition; if less than `threshold` of the pixels moved
+# by more than `pixel_delta`, recognition is skipped. Comparing against the
+# last processed frame (not the previous one) means slow movement still adds
+# up and wakes the detector. A refresh is forced every `refresh_every` frames.
+class MotionGate:
+    def __init__(self, enabled=True, threshold=DEFAULT_MOTION_THRESHOLD, pixel_delta=DEFAULT_PIXEL_DELTA,
+                 width=DEFAULT_MOTION_WIDTH, refresh_every=DEFAULT_REFRESH_EVERY):
+        self.enabled = enabled
+        self.threshold = threshold
+        self.pixel_delta = pixel_delta
+        self.width = width
+        self.refresh_every = refresh_every
+        self.frames = 0
+        self.gated = 0
+        self.last_change = 0.0
+        self._reference = None
+        self._since_refresh = 0
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(**(config or {}))
+
+    @property
+    def gated_ratio(self):
+        return self.gated / self.frames if self.frames else 0.0
+
+    def stats(self):
+        return {
+            'frames': self.frames,
+            'gated': self.gated,
+            'gated_ratio': self.gated_ratio,
+            'last_change': self.last_change,
+        }
+
+    def _small(self, frame):
+        height, width = frame.shape[:2]
+        scale = min(self.width / width, 1.0)
+        small = cv2.resize(frame, (max(int(width * scale), 1), max(int(height * scale), 1)),
+                           interpolation=cv2.INTER_AREA)
+        small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        return cv2.GaussianBlur(small, (5, 5), 0)
+
+    # True when the frame changed enough to be worth running recognition on
+    def should_process(self, frame):
+        self.frames += 1
+        if not self.enabled:
+            return True
+
+        small = self._small(frame)
+        self._since_refresh += 1
+        if self._reference is None or self._reference.shape != small.shape:
+            changed = True
+            self.last_change = 1.0
+        else:
+            diff = cv2.absdiff(small, self._reference)
+            self.last_change = float(np.count_nonzero(diff > self.pixel_delta)) / diff.size
+            changed = self.last_change >= self.threshold
+
+        if changed or (self.refresh_every and self._since_refresh >= self.refresh_every):
+            self._reference = small
+            self._since_refresh = 0
+            return True
+        self.gated += 1
+        return False
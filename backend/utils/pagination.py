@@ -0,0 +1,128 @@
+import base64
+import datetime
+import json
+from collections import namedtuple
+
+from sqlalchemy import func, or_, and_, select
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+SORT_COLUMNS = ('date', 'reg_id', 'name', 'roll_no', 'start_time', 'end_time', 'division', 'branch')
+FILTER_COLUMNS = ('name', 'reg_id', 'roll_no', 'branch', 'division', 'date')
+# Sorted through COALESCE so rows with NULLs are not skipped by the cursor.
+# date is left bare so the (session_code_id, date, id) index serves the
+# order; its NULLs are handled in keyset_page instead.
+_NULLABLE_SORT = ('start_time', 'end_time', 'division', 'branch', 'reg_id')
+
+# One page of rows and the cursor of the next page (None on the last page)
+Page = namedtuple('Page', 'rows next_cursor sort order limit')
+
+
+def encode_cursor(value, row_id):
+    raw = json.dumps([value, row_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        value, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return value, int(row_id)
+    except (ValueError, TypeError, UnicodeError):
+        raise ValueError("Invalid page cursor")
+
+
+# WHERE clauses for attendance of a session, from request arguments. Only
+# known columns are used; start_date/end_date select a range.
+def attendance_filters(Attendance, session_code_id, args):
+    filters = [Attendance.session_code_id == session_code_id]
+    for name in FILTER_COLUMNS:
+        value = args.get(name)
+        if value:
+            filters.append(getattr(Attendance, name) == value)
+    if args.get('start_date'):
+        filters.append(Attendance.date >= args['start_date'])
+    if args.get('end_date'):
+        filters.append(Attendance.date <= args['end_date'])
+    return filters
+
+
+def _sort_expression(Attendance, sort):
+    column = getattr(Attendance, sort)
+    return func.coalesce(column, '') if sort in _NULLABLE_SORT else column
+
+
+# Rows after a (date, id) cursor. MySQL and SQLite sort NULL dates first in
+# ascending order and last in descending order; a None date in the cursor
+# means the page ended among them.
+def _after_date(key, value, last_id, row_id, order):
+    if order == 'asc':
+        if value is None:
+            return or_(key.isnot(None), and_(key.is_(None), row_id > last_id))
+        return or_(key > value, and_(key == value, row_id > last_id))
+    if value is None:
+        return and_(key.is_(None), row_id < last_id)
+    return or_(key < value, and_(key == value, row_id < last_id), key.is_(None))
+
+
+# Keyset pagination: rows come ordered by (sort column, id) and the next page
+# starts strictly after the last row seen, so every page costs the same
+# whatever its depth (no OFFSET scans).
+def keyset_page(db, Attendance, filters, sort='date', order='asc', after=None, limit=DEFAULT_PAGE_SIZE):
+    if sort not in SORT_COLUMNS:
+        sort = 'date'
+    order = 'desc' if order == 'desc' else 'asc'
+    limit = max(1, min(int(limit or DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE))
+    key = _sort_expression(Attendance, sort)
+
+    query = select(Attendance).where(*filters)
+    if after:
+        value, last_id = decode_cursor(after)
+        if sort == 'date' and value is not None:
+            value = datetime.date.fromisoformat(value)
+        if sort == 'date':
+            query = query.where(_after_date(key, value, last_id, Attendance.id, order))
+        elif order == 'asc':
+            query = query.where(or_(key > value, and_(key == value, Attendance.id > last_id)))
+        else:
+            query = query.where(or_(key < value, and_(key == value, Attendance.id < last_id)))
+    if order == 'asc':
+        query = query.order_by(key.asc(), Attendance.id.asc())
+    else:
+        query = query.order_by(key.desc(), Attendance.id.desc())
+
+    rows = db.session.execute(query.limit(limit + 1)).scalars().all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        value = getattr(last, sort)
+        if sort == 'date':
+            value = value.isoformat() if value is not None else None
+        else:
+            value = value or ''
+        next_cursor = encode_cursor(value, last.id)
+    return Page(rows, next_cursor, sort, order, limit)
+
+
+# Total rows and rows per day, counted in SQL
+def attendance_summary(db, Attendance, filters):
+    total = db.session.scalar(select(func.count(Attendance.id)).where(*filters))
+    by_date = db.session.execute(
+        select(Attendance.date, func.count(Attendance.id))
+        .where(*filters).group_by(Attendance.date).order_by(Attendance.date)
+    ).all()
+    return {'total': total, 'by_date': [{'date': d.isoformat(), 'count': count} for d, count in by_date]}
+
+
+def attendance_row(record):
+    return {
+        'name': record.name,
+        'start_time': record.start_time,
+        'end_time': record.end_time,
+        'date': record.date.isoformat() if record.date else None,
+        'roll_no': record.roll_no,
+        'division': record.division,
+        'branch': record.branch,
+        'reg_id': record.reg_id,
+    }
@@ -0,0 +1,205 @@
+import threading
+import time
+
+import cv2
+
+from utils.mjpeg import MjpegOutput
+
+
+# Single-item buffer that always holds the newest value. Writers never block;
+# a value nobody read before the next put is counted as dropped. Readers ask
+# for anything newer than the sequence number they saw last.
+class LatestSlot:
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._item = None
+        self._seq = 0
+        self._read_seq = 0
+        self._closed = False
+        self.dropped = 0
+
+    # 1 while the newest value has not been picked up yet
+    @property
+    def depth(self):
+        return int(self._seq > self._read_seq)
+
+    def put(self, item):
+        with self._cond:
+            if self._seq > self._read_seq:
+                self.dropped += 1
+            self._item = item
+            self._seq += 1
+            self._cond.notify_all()
+
+    def peek_seq(self):
+        return self._seq
+
+    # Newest value without waiting, even if it was already read
+    def peek(self):
+        with self._cond:
+            self._read_seq = self._seq
+            return self._seq, self._item
+
+    # Wait for a value newer than after_seq; returns (seq, item), or
+    # (after_seq, None) on timeout or once the slot is closed
+    def get(self, after_seq=0, timeout=None):
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._seq > after_seq or self._closed, timeout):
+                return after_seq, None
+            if self._seq <= after_seq:
+                return after_seq, None
+            self._read_seq = max(self._read_seq, self._seq)
+            return self._seq, self._item
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+DEFAULT_MAX_BACKOFF = 30.0
+
+
+# Capture -> inference -> annotate/JPEG pipeline for one camera. Capture and
+# inference run on their own threads and only ever work on the newest input,
+# so a slow recognition step lowers the annotation rate instead of delaying
+# the video. With a scheduler, inference runs on the scheduler's shared
+# workers instead of a thread of its own. Annotation and JPEG encoding happen
+# on demand in the MJPEG output stage, only while someone is watching.
+class FramePipeline:
+    def __init__(self, source, recognizer, open_camera=cv2.VideoCapture, scheduler=None,
+                 max_backoff=DEFAULT_MAX_BACKOFF, poll_timeout=0.5, output_settings=None):
+        self.source = source
+        self.open_camera = open_camera
+        self.camera = None
+        self.recognizer = recognizer
+        self.scheduler = scheduler
+        self.max_backoff = max_backoff
+        self.poll_timeout = poll_timeout
+        self.state = 'starting'
+        self.reconnects = 0
+        self.last_frame_at = None
+        self.frames = LatestSlot()    # raw captured frames
+        self.results = LatestSlot()   # recognition results
+        self.output = MjpegOutput(self, **(output_settings or {}))
+        self.stage_seconds = {'capture': 0.0, 'inference': 0.0}
+        self.stage_counts = {'capture': 0, 'inference': 0}
+        self._stop = threading.Event()
+        self._threads = []
+
+    @property
+    def running(self):
+        return not self._stop.is_set()
+
+    def start(self):
+        stages = [('capture', self._capture)]
+        if self.scheduler is None:
+            stages.append(('inference', self._inference))
+        for name, target in stages:
+            thread = threading.Thread(target=target, name=f'pipeline-{name}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self):
+        self._stop.set()
+        for slot in (self.frames, self.results):
+            slot.close()
+        for thread in self._threads:
+            if thread is not threading.current_thread():
+                thread.join(timeout=2)
+        self._threads = []
+        if self.camera is not None:
+            self.camera.release()
+            self.camera = None
+        self.state = 'stopped'
+
+    def stats(self):
+        return {
+            'state': self.state,
+            'reconnects': self.reconnects,
+            'seconds_since_frame': time.time() - self.last_frame_at if self.last_frame_at else None,
+            'queue_depth': {
+                'capture': self.frames.depth,
+                'inference': self.results.depth,
+            },
+            'dropped': {
+                'capture': self.frames.dropped,
+                'inference': self.results.dropped,
+            },
+            'frames': dict(self.stage_counts),
+            'avg_seconds': {
+                stage: self.stage_seconds[stage] / count if count else 0.0
+                for stage, count in self.stage_counts.items()
+            },
+            'output': self.output.stats(),
+            'recognizer': self.recognizer.stats(),
+        }
+
+    def _timed(self, stage, started):
+        elapsed = time.perf_counter() - started
+        self.stage_seconds[stage] += elapsed
+        self.stage_counts[stage] += 1
+        return elapsed
+
+    def _open(self):
+        camera = self.open_camera(self.source)
+        if camera is not None and camera.isOpened():
+            return camera
+        if camera is not None:
+            camera.release()
+        return None
+
+    # Read frames until stopped, reopening the camera with exponential backoff
+    # whenever it cannot be opened or a read fails
+    def _capture(self):
+        backoff = 1.0
+        while self.running:
+            if self.camera is None:
+                self.camera = self._open()
+                if self.camera is None:
+                    self.state = 'reconnecting'
+                    print(f"Camera {self.source} unavailable, retrying in {backoff:.0f}s")
+                    self._stop.wait(backoff)
+                    backoff = min(backoff * 2, self.max_backoff)
+                    continue
+            started = time.perf_counter()
+            success, frame = self.camera.read()
+            if not success:
+                print(f"Camera {self.source} read failed, reconnecting")
+                self.camera.release()
+                self.camera = None
+                self.reconnects += 1
+                continue
+            backoff = 1.0
+            self.state = 'running'
+            self.last_frame_at = time.time()
+            self.frames.put(frame)
+            if self.scheduler is not None:
+                self.scheduler.notify()
+            self.recognizer.metrics.observe('capture', self._timed('capture', started))
+
+    # Run recognition on the newest frame if it is newer than after_seq;
+    # returns the sequence number of the frame processed
+    def infer(self, after_seq=0):
+        seq, frame = self.frames.peek()
+        if frame is None or seq <= after_seq:
+            return after_seq
+        started = time.perf_counter()
+        try:
+            self.results.put(self.recognizer.process(frame))
+        except Exception as e:
+            print("Error in recognition:", e)
+        self._timed('inference', started)
+        return seq
+
+    def _inference(self):
+        seq = 0
+        while self.running:
+            newest, _ = self.frames.get(seq, self.poll_timeout)
+            if newest > seq:
+                seq = self.infer(seq)
+
+    # Multipart MJPEG chunks of the newest annotated frames, for `duration` seconds
+    def stream(self, duration=None, **settings):
+        return self.output.stream(duration, **settings)
@@ -0,0 +1,88 @@
+import os
+
+import cv2
+import dlib
+import face_recognition
+
+# Longest side of a stored enrollment photo; larger uploads are downsized
+DEFAULT_MAX_SIDE = 1280
+# Longest side of the copy the face is detected on. Enrollment faces fill
+# much of the photo, so HOG finds them well below the stored resolution.
+DEFAULT_DETECT_SIDE = 640
+# Aligned chip as dlib cuts it for the embedding network
+DEFAULT_CHIP_SIZE = 150
+DEFAULT_CHIP_PADDING = 0.25
+CHIP_FOLDER = '.chips'
+# Uploads wait here, outside the session folders, until the student is saved
+STAGING_FOLDER = '.staging'
+
+
+class PreprocessError(ValueError):
+    pass
+
+
+# Where the aligned face chip of an uploaded image is kept, next to the
+# thumbnails and outside the session folders
+def chip_path(upload_folder, session_code_id, filename):
+    return os.path.join(upload_folder, CHIP_FOLDER, str(session_code_id), filename + '.png')
+
+
+def _fit(img, max_side):
+    height, width = img.shape[:2]
+    scale = max_side / max(height, width)
+    if scale >= 1:
+        return img, 1.0
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    return cv2.resize(img, size, interpolation=cv2.INTER_AREA), scale
+
+
+# Downsize an uploaded photo in place, find its single face and save the
+# aligned chip. Returns (rgb image, face location) in the stored image's
+# (top, right, bottom, left) coordinates, ready for
+# face_recognition.face_encodings(img, [location]). Raises PreprocessError
+# when the photo cannot be read or does not show exactly one face.
+def preprocess_photo(path, chip_file=None, max_side=DEFAULT_MAX_SIDE, detect_side=DEFAULT_DETECT_SIDE,
+                     chip_size=DEFAULT_CHIP_SIZE):
+    img = cv2.imread(path)
+    if img is None:
+        raise PreprocessError("Could not read image")
+    img, scale = _fit(img, max_side)
+    rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+    small, detect_scale = _fit(rgb, detect_side)
+    locations = face_recognition.face_locations(small)
+    if not locations:
+        raise PreprocessError("No face found")
+    if len(locations) > 1:
+        raise PreprocessError(f"{len(locations)} faces found")
+    height, width = rgb.shape[:2]
+    top, right, bottom, left = (round(value / detect_scale) for value in locations[0])
+    location = (max(top, 0), min(right, width), min(bottom, height), max(left, 0))
+
+    # Rewritten only when downsized, so small uploads keep their bytes; the
+    # temporary name keeps the extension cv2 picks the format from
+    if scale < 1:
+        root, extension = os.path.splitext(path)
+        tmp_path = f"{root}.{os.getpid()}.tmp{extension}"
+        if not cv2.imwrite(tmp_path, img):
+            raise PreprocessError("Could not save resized image")
+        os.replace(tmp_path, path)
+
+    if chip_file is not None:
+        top, right, bottom, left = location
+        landmarks = face_recognition.api.pose_predictor_5_point(rgb, dlib.rectangle(left, top, right, bottom))
+        chip = dlib.get_face_chip(rgb, landmarks, size=chip_size, padding=DEFAULT_CHIP_PADDING)
+        os.makedirs(os.path.dirname(chip_file), exist_ok=True)
+        cv2.imwrite(chip_file, cv2.cvtColor(chip, cv2.COLOR_RGB2BGR))
+    return rgb, location
+
+
+# Preprocess an already stored upload. Runs inside a pool worker; returns
+# (path, location, error) so one bad photo does not stop the batch.
+def preprocess_upload(path, chip_folder=None, **settings):
+    try:
+        chip_file = os.path.join(chip_folder, os.path.basename(path) + '.png') if chip_folder else None
+        _, location = preprocess_photo(path, chip_file, **settings)
+        return path, location, None
+    except Exception as e:
+        return path, None, str(e)
@@ -0,0 +1,124 @@
+import datetime
+import time
+from collections import namedtuple
+
+import cv2
+import cvzone
+import face_recognition
+
+from utils.attendance import attendance_recorder
+from utils.detection import FaceDetector
+from utils.gallery import DEFAULT_TOLERANCE
+from utils.metrics import StageMetrics
+from utils.motion import MotionGate
+from utils.roster import EMPTY_ROSTER_ENTRY
+
+# One recognized (or unknown) face, with its box in full frame coordinates
+FaceResult = namedtuple('FaceResult', 'box student_id name roll_no division branch')
+
+
+# Detects, identifies and records the faces of one session in camera frames
+class Recognizer:
+    def __init__(self, session_code_id, gallery, roster, tracker,
+                 tolerance=DEFAULT_TOLERANCE, detector=None, motion_gate=None, recorder=attendance_recorder,
+                 camera_id=None):
+        self.session_code_id = session_code_id
+        self.camera_id = camera_id
+        self.gallery = gallery
+        self.roster = roster
+        self.tracker = tracker
+        self.tolerance = tolerance
+        self.detector = detector or FaceDetector()
+        self.motion_gate = motion_gate or MotionGate(enabled=False)
+        self.recorder = recorder
+        self.metrics = StageMetrics(camera_id, session_code_id)
+        self.last_results = []
+
+    # Swap in a new gallery and/or roster, e.g. after students were enrolled;
+    # the next frame uses them
+    def refresh(self, gallery=None, roster=None):
+        if gallery is not None:
+            self.gallery = gallery
+        if roster is not None:
+            self.roster = roster
+
+    def stats(self):
+        return {
+            'embeddings_computed': self.tracker.embeddings_computed,
+            'embeddings_skipped': self.tracker.embeddings_skipped,
+            'detection': self.detector.stats(),
+            'motion': self.motion_gate.stats(),
+        }
+
+    def process(self, frame):
+        metrics = self.metrics
+        started = time.perf_counter()
+
+        # Unchanged scene: keep the last annotation, the same people are still there
+        moved = self.motion_gate.should_process(frame)
+        started = self._timed('motion', started)
+        if not moved:
+            self._record(self.last_results)
+            return self.last_results
+
+        faceCurFrame = self.detector.detect(frame)
+        metrics.observe('resize', self.detector.last_resize_seconds)
+        metrics.observe('face_locations', self.detector.last_seconds - self.detector.last_resize_seconds)
+        started = time.perf_counter()
+
+        # Only new tracks and tracks due for re-verification are embedded
+        tracks = self.tracker.update(faceCurFrame)
+        toEmbed = [i for i, (_, needs_embedding) in enumerate(tracks) if needs_embedding]
+        started = self._timed('track', started)
+        if toEmbed:
+            # Boxes are in full frame coordinates, whatever scale found them
+            img = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            started = self._timed('cvtcolor', started)
+            encodeCurFrame = face_recognition.face_encodings(img, [faceCurFrame[i] for i in toEmbed])
+            started = self._timed('face_encodings', started)
+            # All new faces in the frame are matched against the gallery in one pass
+            matchedIds = self.gallery.best_matches(encodeCurFrame, self.tolerance)
+            for i, student_id in zip(toEmbed, matchedIds):
+                self.tracker.assign(tracks[i][0], student_id)
+            started = self._timed('match', started)
+
+        results = []
+        for (track, _), faceLoc in zip(tracks, faceCurFrame):
+            student_id = track.student_id
+            _, name, roll_no, div, branch = self.roster.get(student_id, EMPTY_ROSTER_ENTRY)
+            results.append(FaceResult(faceLoc, student_id, name, roll_no, div, branch))
+        self._timed('roster', started)
+
+        matched = sum(1 for result in results if result.student_id)
+        metrics.detected.inc(len(results))
+        metrics.matched.inc(matched)
+        metrics.unknown.inc(len(results) - matched)
+        self._record(results)
+        self.last_results = results
+        return results
+
+    # Record the time since `started` for a stage; returns the current time
+    def _timed(self, stage, started):
+        now = time.perf_counter()
+        self.metrics.observe(stage, now - started)
+        return now
+
+    def _record(self, results):
+        current_date = datetime.datetime.now().date()
+        for result in results:
+            if result.student_id:
+                self.recorder.record(result.name, current_date, result.roll_no, result.division,
+                                     result.branch, result.student_id, self.session_code_id)
+
+
+# Draw boxes, names and registration ids onto the frame in place
+def annotate(frame, results):
+    for result in results:
+        y1, x2, y2, x1 = result.box
+        bbox = x1, y1, x2 - x1, y2 - y1
+        imgBackground = cvzone.cornerRect(frame, bbox, rt=0)
+        cv2.putText(frame, result.name or 'Unknown', (bbox[0], bbox[1] - 35), cv2.FONT_HERSHEY_SIMPLEX, 0.9,
+                    (255, 255, 0), 3, lineType=cv2.LINE_AA)
+        cv2.putText(imgBackground, result.student_id or '',
+                    (bbox[0], bbox[1] - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 255, 255), 2)
+    return frame
@@ -0,0 +1,234 @@
+import datetime
+from collections import defaultdict
+
+from sqlalchemy import delete, func, select, tuple_
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from models import Attendance, AttendanceDailySummary, AttendanceMonthlyStudent
+from utils.export import iter_rows
+
+DEFAULT_REPORT_LIMIT = 100
+MAX_REPORT_LIMIT = 1000
+
+_DAILY_KEY = ['session_code_id', 'date', 'branch', 'division']
+_MONTHLY_KEY = ['session_code_id', 'reg_id', 'month']
+
+
+def month_start(day):
+    return day.replace(day=1)
+
+
+def month_end(day):
+    following = (day.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+    return following - datetime.timedelta(days=1)
+
+
+# Keys (reg_id, date, session_code_id) of the rows that already have an
+# attendance record; the rest of the batch is new and counts in the rollups
+def existing_attendance_keys(db, Attendance, rows):
+    keys = [(row['reg_id'], row['date'], row['session_code_id']) for row in rows]
+    return set(db.session.query(Attendance.reg_id, Attendance.date, Attendance.session_code_id).filter(
+        tuple_(Attendance.reg_id, Attendance.date, Attendance.session_code_id).in_(keys)
+    ).all())
+
+
+# Increment rows of a rollup table: insert the keys that are missing and add
+# `column` to the ones that exist, in one statement on MySQL and SQLite
+def _increment(db, model, key, column, rows, refresh=()):
+    dialect = db.session.get_bind().dialect.name
+    table = model.__table__
+    if dialect in ('mysql', 'mariadb'):
+        stmt = mysql_insert(table).values(rows)
+        values = {column: table.c[column] + stmt.inserted[column]}
+        values.update({name: stmt.inserted[name] for name in refresh})
+        db.session.execute(stmt.on_duplicate_key_update(**values))
+    elif dialect == 'sqlite':
+        stmt = sqlite_insert(table).values(rows)
+        values = {column: table.c[column] + stmt.excluded[column]}
+        values.update({name: stmt.excluded[name] for name in refresh})
+        db.session.execute(stmt.on_conflict_do_update(index_elements=key, set_=values))
+    else:
+        for row in rows:
+            found = db.session.execute(
+                select(table.c.id, table.c[column]).where(*[table.c[name] == row[name] for name in key])
+            ).first()
+            if found is None:
+                db.session.execute(table.insert().values(row))
+            else:
+                values = {column: found[1] + row[column]}
+                values.update({name: row[name] for name in refresh})
+                db.session.execute(table.update().where(table.c.id == found[0]).values(values))
+
+
+# Add newly inserted attendance rows to the daily and monthly rollups. Runs
+# inside the attendance transaction so both are committed together.
+def update_rollups(db, new_rows):
+    daily = defaultdict(int)
+    monthly = {}
+    for row in new_rows:
+        branch, division = row.get('branch') or '', row.get('division') or ''
+        daily[(row['session_code_id'], row['date'], branch, division)] += 1
+        if not row.get('reg_id'):
+            continue
+        key = (row['session_code_id'], row['reg_id'], month_start(row['date']))
+        entry = monthly.setdefault(key, {
+            'session_code_id': key[0], 'reg_id': key[1], 'month': key[2], 'days_present': 0,
+        })
+        entry.update(name=row.get('name'), branch=branch, division=division)
+        entry['days_present'] += 1
+
+    if daily:
+        _increment(db, AttendanceDailySummary, _DAILY_KEY, 'present', [
+            {'session_code_id': s, 'date': d, 'branch': b, 'division': v, 'present': count}
+            for (s, d, b, v), count in daily.items()
+        ])
+    if monthly:
+        _increment(db, AttendanceMonthlyStudent, _MONTHLY_KEY, 'days_present', list(monthly.values()),
+                   refresh=('name', 'branch', 'division'))
+
+
+# Recompute the rollups from the attendance table, for existing history or
+# to repair drift. The range is widened to whole months so monthly totals
+# stay complete. Each session is rebuilt in its own transaction.
+# Returns {session_code_id: attendance rows counted}.
+def rebuild_rollups(db, session_code_id=None, start=None, end=None):
+    start = month_start(start) if start else None
+    end = month_end(end) if end else None
+
+    def in_range(column):
+        conditions = []
+        if start:
+            conditions.append(column >= start)
+        if end:
+            conditions.append(column <= end)
+        return conditions
+
+    if session_code_id is None:
+        sessions = db.session.scalars(select(Attendance.session_code_id).distinct()).all()
+    else:
+        sessions = [session_code_id]
+
+    counted = {}
+    for session_id in sessions:
+        try:
+            db.session.execute(delete(AttendanceDailySummary).where(
+                AttendanceDailySummary.session_code_id == session_id, *in_range(AttendanceDailySummary.date)))
+            db.session.execute(delete(AttendanceMonthlyStudent).where(
+                AttendanceMonthlyStudent.session_code_id == session_id, *in_range(AttendanceMonthlyStudent.month)))
+
+            # Daily counts are a plain GROUP BY
+            branch = func.coalesce(Attendance.branch, '')
+            division = func.coalesce(Attendance.division, '')
+            daily = db.session.execute(
+                select(Attendance.date, branch, division, func.count(Attendance.id))
+                .where(Attendance.session_code_id == session_id, *in_range(Attendance.date))
+                .group_by(Attendance.date, branch, division)
+            ).all()
+            if daily:
+                db.session.execute(AttendanceDailySummary.__table__.insert(), [
+                    {'session_code_id': session_id, 'date': day, 'branch': b, 'division': v, 'present': count}
+                    for day, b, v, count in daily
+                ])
+
+            # Months are bucketed here rather than in SQL, which has no
+            # portable month truncation; rows are streamed in date order so
+            # the latest name/branch/division of a student wins
+            monthly = {}
+            query = (select(Attendance.reg_id, Attendance.date, Attendance.name,
+                            Attendance.branch, Attendance.division)
+                     .where(Attendance.session_code_id == session_id, Attendance.reg_id.isnot(None),
+                            *in_range(Attendance.date))
+                     .order_by(Attendance.date))
+            for rows in iter_rows(db, query):
+                for reg_id, day, name, b, v in rows:
+                    key = (reg_id, month_start(day))
+                    entry = monthly.setdefault(key, {
+                        'session_code_id': session_id, 'reg_id': reg_id, 'month': key[1], 'days_present': 0,
+                    })
+                    entry.update(name=name, branch=b or '', division=v or '')
+                    entry['days_present'] += 1
+            if monthly:
+                db.session.execute(AttendanceMonthlyStudent.__table__.insert(), list(monthly.values()))
+
+            db.session.commit()
+            counted[session_id] = sum(row[3] for row in daily)
+        except Exception:
+            db.session.rollback()
+            raise
+    return counted
+
+
+def _branch_filters(model, branch=None, division=None):
+    filters = []
+    if branch:
+        filters.append(model.branch == branch)
+    if division:
+        filters.append(model.division == division)
+    return filters
+
+
+# Students present per day, from the daily rollup
+def daily_report(db, session_code_id, start=None, end=None, branch=None, division=None):
+    model = AttendanceDailySummary
+    filters = [model.session_code_id == session_code_id] + _branch_filters(model, branch, division)
+    if start:
+        filters.append(model.date >= start)
+    if end:
+        filters.append(model.date <= end)
+    rows = db.session.execute(
+        select(model.date, func.sum(model.present)).where(*filters).group_by(model.date).order_by(model.date)
+    ).all()
+    return [{'date': day.isoformat(), 'present': int(present)} for day, present in rows]
+
+
+# Presence per branch and division over a date range, from the daily rollup
+def branch_report(db, session_code_id, start=None, end=None):
+    model = AttendanceDailySummary
+    filters = [model.session_code_id == session_code_id]
+    if start:
+        filters.append(model.date >= start)
+    if end:
+        filters.append(model.date <= end)
+    rows = db.session.execute(
+        select(model.branch, model.division, func.sum(model.present), func.count(model.date))
+        .where(*filters).group_by(model.branch, model.division).order_by(model.branch, model.division)
+    ).all()
+    return [{
+        'branch': b, 'division': v, 'present': int(present), 'days': days,
+        'average_present': round(int(present) / days, 2) if days else 0.0,
+    } for b, v, present, days in rows]
+
+
+# Days present per student over whole months, with the share of class days
+# (days on which anyone in the same branch/division filter was present).
+# Students are paged by reg_id: pass the last reg_id seen as `after`.
+def student_report(db, session_code_id, start_month, end_month, branch=None, division=None,
+                   after=None, limit=DEFAULT_REPORT_LIMIT):
+    limit = max(1, min(int(limit or DEFAULT_REPORT_LIMIT), MAX_REPORT_LIMIT))
+    start_month, end_month = month_start(start_month), month_start(end_month)
+
+    daily = AttendanceDailySummary
+    class_days = db.session.scalar(
+        select(func.count(func.distinct(daily.date))).where(
+            daily.session_code_id == session_code_id,
+            daily.date >= start_month, daily.date <= month_end(end_month),
+            *_branch_filters(daily, branch, division))
+    ) or 0
+
+    model = AttendanceMonthlyStudent
+    filters = [model.session_code_id == session_code_id,
+               model.month >= start_month, model.month <= end_month] + _branch_filters(model, branch, division)
+    if after:
+        filters.append(model.reg_id > after)
+    rows = db.session.execute(
+        select(model.reg_id, func.max(model.name), func.sum(model.days_present))
+        .where(*filters).group_by(model.reg_id).order_by(model.reg_id).limit(limit + 1)
+    ).all()
+
+    next_cursor = rows[limit - 1][0] if len(rows) > limit else None
+    students = [{
+        'reg_id': reg_id, 'name': name, 'days_present': int(days),
+        'percentage': round(100.0 * int(days) / class_days, 1) if class_days else 0.0,
+    } for reg_id, name, days in rows[:limit]]
+    return {'class_days': class_days, 'students': students, 'next': next_cursor}
@@ -0,0 +1,53 @@
+import threading
+
+# Returned for ids that are not enrolled, matching mysqlconnect()'s shape
+EMPTY_ROSTER_ENTRY = (None, None, None, None, None)
+
+
+# Per-session map of regid -> (id, name, rollno, division, branch), loaded
+# with one query so recognized faces are resolved without touching MySQL
+class RosterCache:
+    def __init__(self):
+        self._rosters = {}
+        self._lock = threading.Lock()
+
+    # Load the whole roster of a session in a single query
+    def load(self, session_code_id):
+        from app import Student_data, app, db
+
+        with app.app_context():
+            roster = load_roster(db, Student_data, session_code_id)
+        with self._lock:
+            self._rosters[str(session_code_id)] = roster
+        return roster
+
+    # Cached roster of a session, loaded on first use
+    def get(self, session_code_id):
+        roster = self._rosters.get(str(session_code_id))
+        if roster is None:
+            roster = self.load(session_code_id)
+        return roster
+
+    def lookup(self, session_code_id, regid):
+        return self.get(session_code_id).get(regid, EMPTY_ROSTER_ENTRY)
+
+    # Drop a session so the next stream reloads it, e.g. after enrolling a student
+    def invalidate(self, session_code_id):
+        with self._lock:
+            self._rosters.pop(str(session_code_id), None)
+
+
+# regid -> (id, name, rollno, division, branch) for every student of a session
+def load_roster(db, Student_data, session_code_id):
+    rows = db.session.query(
+        Student_data.regid,
+        Student_data.id,
+        Student_data.name,
+        Student_data.rollno,
+        Student_data.division,
+        Student_data.branch,
+    ).filter_by(session_code_id=session_code_id).all()
+    return {row[0]: tuple(row[1:]) for row in rows}
+
+
+roster_cache = RosterCache()
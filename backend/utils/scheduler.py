@@ -0,0 +1,125 @@
+import threading
+import time
+
+DEFAULT_INFERENCE_WORKERS = 2
+DEFAULT_TARGET_FPS = 5.0
+
+# Weight of the newest sample in the moving averages below
+_EWMA_ALPHA = 0.2
+
+
+# Scheduling state of one camera
+class ScheduledCamera:
+    def __init__(self, key, pipeline, target_fps):
+        self.key = key
+        self.pipeline = pipeline
+        self.period = 1.0 / target_fps if target_fps else 0.0
+        self.deadline = time.monotonic()
+        self.seq = 0
+        self.busy = False
+        self.runs = 0
+        self.fps = 0.0
+        self.lag = 0.0
+        self.max_lag = 0.0
+        self.last_finished = None
+
+    def ready(self):
+        return not self.busy and self.pipeline.frames.peek_seq() > self.seq
+
+
+# Runs recognition for all cameras on a fixed number of worker threads.
+# Each camera has at most one job in flight and is due every 1/target_fps
+# seconds; workers always take the ready camera with the earliest deadline,
+# so a burst of faces on one camera delays only that camera.
+class InferenceScheduler:
+    def __init__(self, workers=DEFAULT_INFERENCE_WORKERS, poll_timeout=0.5):
+        self.workers = workers
+        self.poll_timeout = poll_timeout
+        self._cameras = {}
+        self._cond = threading.Condition()
+        self._threads = []
+        self._stop = False
+
+    def register(self, key, pipeline, target_fps=DEFAULT_TARGET_FPS):
+        with self._cond:
+            self._cameras[key] = ScheduledCamera(key, pipeline, target_fps)
+            self._start()
+            self._cond.notify_all()
+
+    def unregister(self, key):
+        with self._cond:
+            self._cameras.pop(key, None)
+
+    # Called by a pipeline whenever it captured a new frame
+    def notify(self):
+        with self._cond:
+            self._cond.notify()
+
+    def shutdown(self):
+        with self._cond:
+            self._stop = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout=2)
+        self._threads = []
+
+    def stats(self):
+        with self._cond:
+            return {
+                key: {
+                    'target_fps': 1.0 / camera.period if camera.period else None,
+                    'achieved_fps': camera.fps,
+                    'lag_seconds': camera.lag,
+                    'max_lag_seconds': camera.max_lag,
+                    'runs': camera.runs,
+                }
+                for key, camera in self._cameras.items()
+            }
+
+    def _start(self):
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._work, name=f'inference-{len(self._threads)}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    # Earliest-deadline ready camera, or (None, seconds to wait)
+    def _next(self):
+        now = time.monotonic()
+        ready = [camera for camera in self._cameras.values() if camera.ready()]
+        if not ready:
+            return None, self.poll_timeout
+        camera = min(ready, key=lambda c: c.deadline)
+        if camera.deadline > now:
+            return None, camera.deadline - now
+        return camera, 0.0
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._stop:
+                        return
+                    camera, wait = self._next()
+                    if camera is not None:
+                        break
+                    self._cond.wait(wait)
+                camera.busy = True
+                started = time.monotonic()
+                lag = started - camera.deadline
+                camera.lag = (1 - _EWMA_ALPHA) * camera.lag + _EWMA_ALPHA * lag
+                camera.max_lag = max(camera.max_lag, lag)
+
+            try:
+                camera.seq = camera.pipeline.infer(camera.seq)
+            finally:
+                with self._cond:
+                    finished = time.monotonic()
+                    camera.busy = False
+                    camera.runs += 1
+                    if camera.last_finished is not None and finished > camera.last_finished:
+                        fps = 1.0 / (finished - camera.last_finished)
+                        camera.fps = fps if camera.fps == 0.0 else (1 - _EWMA_ALPHA) * camera.fps + _EWMA_ALPHA * fps
+                    camera.last_finished = finished
+                    # Due again one period after this run started
+                    camera.deadline = started + camera.period
+                    self._cond.notify_all()
@@ -0,0 +1,92 @@
+import os
+import threading
+
+import cv2
+
+THUMBNAIL_SIZES = (160, 320, 640)
+DEFAULT_THUMBNAIL_SIZE = 320
+DEFAULT_THUMBNAIL_QUALITY = 80
+DEFAULT_IMAGES_PER_PAGE = 60
+MAX_IMAGES_PER_PAGE = 240
+# Versioned image URLs never change content, so browsers may keep them this long
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+THUMBNAIL_FOLDER = '.thumbs'
+
+
+# Where the thumbnail of an uploaded image is kept. Thumbnails live outside
+# the session folders so the encoder and the listing never see them.
+def thumbnail_path(upload_folder, session_code_id, filename, size=DEFAULT_THUMBNAIL_SIZE):
+    return os.path.join(upload_folder, THUMBNAIL_FOLDER, str(session_code_id), str(size), filename + '.jpg')
+
+
+# Path of an up to date thumbnail of source, generated when it is missing or
+# stale. The thumbnail's mtime is set to the source's, so any
+# change to the source (replaced photo, restored backup) invalidates it.
+def ensure_thumbnail(source, thumb, size=DEFAULT_THUMBNAIL_SIZE, quality=DEFAULT_THUMBNAIL_QUALITY):
+    source_mtime = os.stat(source).st_mtime_ns
+    try:
+        if os.stat(thumb).st_mtime_ns == source_mtime:
+            return thumb
+    except FileNotFoundError:
+        pass
+
+    img = cv2.imread(source)
+    if img is None:
+        raise ValueError(f"Could not read image: {source}")
+    height, width = img.shape[:2]
+    scale = size / max(height, width)
+    if scale < 1:
+        img = cv2.resize(img, (max(1, round(width * scale)), max(1, round(height * scale))),
+                         interpolation=cv2.INTER_AREA)
+    ok, buffer = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise ValueError(f"Could not encode thumbnail: {source}")
+
+    # Written under a unique name and renamed, so concurrent requests for the
+    # same thumbnail never serve a partial file
+    os.makedirs(os.path.dirname(thumb), exist_ok=True)
+    tmp_path = f"{thumb}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as file:
+        file.write(buffer.tobytes())
+    os.utime(tmp_path, ns=(source_mtime, source_mtime))
+    os.replace(tmp_path, thumb)
+    return thumb
+
+
+# Per-folder cache of the image files of a session folder as sorted
+# (filename, mtime_ns, size) tuples. A listing is rebuilt only when the
+# folder's mtime changes (files added, removed or renamed), so a page view
+# costs one stat instead of a listdir plus a stat per file.
+class ImageListingCache:
+    def __init__(self):
+        self._listings = {}
+        self._lock = threading.Lock()
+
+    def get(self, folder):
+        try:
+            folder_mtime = os.stat(folder).st_mtime_ns
+        except FileNotFoundError:
+            return []
+        cached = self._listings.get(folder)
+        if cached is not None and cached[0] == folder_mtime:
+            return cached[1]
+
+        listing = []
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if entry.is_file() and not entry.name.startswith('.'):
+                    stat = entry.stat()
+                    listing.append((entry.name, stat.st_mtime_ns, stat.st_size))
+        listing.sort()
+        with self._lock:
+            self._listings[folder] = (folder_mtime, listing)
+        return listing
+
+    # Drop a folder after writing to it; the folder mtime may be too coarse
+    # to notice several uploads within the same tick
+    def invalidate(self, folder):
+        with self._lock:
+            self._listings.pop(folder, None)
+
+
+image_listing_cache = ImageListingCache()
@@ -0,0 +1,100 @@
+import itertools
+
+import numpy as np
+
+DEFAULT_IOU_THRESHOLD = 0.3
+DEFAULT_REVERIFY_FRAMES = 15
+DEFAULT_MAX_MISSES = 5
+
+
+# A face followed across frames; carries the identity of its last embedding
+class Track:
+    def __init__(self, track_id, box, frame_no):
+        self.track_id = track_id
+        self.box = box
+        self.student_id = None
+        self.last_embedded = None
+        self.last_seen = frame_no
+        self.misses = 0
+
+
+# Intersection over union between two lists of (top, right, bottom, left) boxes
+def iou_matrix(boxes_a, boxes_b):
+    a = np.asarray(boxes_a, dtype=np.float32).reshape(-1, 4)
+    b = np.asarray(boxes_b, dtype=np.float32).reshape(-1, 4)
+    top = np.maximum(a[:, None, 0], b[None, :, 0])
+    right = np.minimum(a[:, None, 1], b[None, :, 1])
+    bottom = np.minimum(a[:, None, 2], b[None, :, 2])
+    left = np.maximum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(bottom - top, 0, None) * np.clip(right - left, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 1] - a[:, 3])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 1] - b[:, 3])
+    union = area_a[:, None] + area_b[None, :] - inter
+    return np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+
+
+# Associates detected boxes with existing tracks by greedy IoU matching, so a
+# face only needs a new embedding when its track is new or due for re-verification
+class FaceTracker:
+    def __init__(self, iou_threshold=DEFAULT_IOU_THRESHOLD,
+                 reverify_every=DEFAULT_REVERIFY_FRAMES, max_misses=DEFAULT_MAX_MISSES):
+        self.iou_threshold = iou_threshold
+        self.reverify_every = reverify_every
+        self.max_misses = max_misses
+        self.tracks = []
+        self.frame_no = 0
+        self.embeddings_computed = 0
+        self.embeddings_skipped = 0
+        self._ids = itertools.count(1)
+
+    # Returns one (track, needs_embedding) pair per box, in box order
+    def update(self, boxes):
+        self.frame_no += 1
+        boxes = list(boxes)
+        assigned = [None] * len(boxes)
+        matched_tracks = set()
+
+        if boxes and self.tracks:
+            overlap = iou_matrix(boxes, [track.box for track in self.tracks])
+            # Best overlapping pairs first
+            for flat in np.argsort(overlap, axis=None)[::-1]:
+                box_idx, track_idx = np.unravel_index(flat, overlap.shape)
+                if overlap[box_idx, track_idx] < self.iou_threshold:
+                    break
+                if assigned[box_idx] is not None or track_idx in matched_tracks:
+                    continue
+                assigned[box_idx] = self.tracks[track_idx]
+                matched_tracks.add(track_idx)
+
+        for idx, track in enumerate(self.tracks):
+            if idx not in matched_tracks:
+                track.misses += 1
+        self.tracks = [track for track in self.tracks if track.misses <= self.max_misses]
+
+        results = []
+        for box_idx, box in enumerate(boxes):
+            track = assigned[box_idx]
+            if track is None:
+                track = Track(next(self._ids), box, self.frame_no)
+                self.tracks.append(track)
+            track.box = box
+            track.last_seen = self.frame_no
+            track.misses = 0
+            needs_embedding = (track.last_embedded is None or
+                               self.frame_no - track.last_embedded >= self.reverify_every)
+            if needs_embedding:
+                self.embeddings_computed += 1
+            else:
+                self.embeddings_skipped += 1
+            results.append((track, needs_embedding))
+        return results
+
+    # Store the identity found for a freshly embedded track
+    def assign(self, track, student_id):
+        track.student_id = student_id
+        track.last_embedded = self.frame_no
+
+    @property
+    def skip_ratio(self):
+        total = self.embeddings_computed + self.embeddings_skipped
+        return self.embeddings_skipped / total if total else 0.0
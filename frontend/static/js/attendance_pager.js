@@ -0,0 +1,37 @@
+// "Load more" for paginated attendance tables: fetches the next page from
+// the JSON API and appends its rows to the table.
+document.querySelectorAll('[data-attendance-pager]').forEach(function (button) {
+    if (button.dataset.bound) {
+        return;
+    }
+    button.dataset.bound = 'true';
+    var table = document.getElementById(button.dataset.table);
+    var columns = button.dataset.columns.split(',');
+
+    button.addEventListener('click', function () {
+        var url = button.dataset.url + '&after=' + encodeURIComponent(button.dataset.next);
+        button.disabled = true;
+        fetch(url, { credentials: 'same-origin' })
+            .then(function (response) { return response.json(); })
+            .then(function (page) {
+                page.rows.forEach(function (row) {
+                    var tr = document.createElement('tr');
+                    columns.forEach(function (column) {
+                        var td = document.createElement('td');
+                        td.textContent = row[column] === null ? '' : row[column];
+                        tr.appendChild(td);
+                    });
+                    table.tBodies[0].appendChild(tr);
+                });
+                if (page.next) {
+                    button.dataset.next = page.next;
+                    button.disabled = false;
+                } else {
+                    button.remove();
+                }
+            })
+            .catch(function () {
+                button.disabled = false;
+            });
+    });
+});